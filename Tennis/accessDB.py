@@ -1,30 +1,139 @@
-from sqlalchemy import create_engine, select, and_, alias, or_, Table, MetaData, not_
+from sqlalchemy import create_engine, select, and_, alias, or_, Table, MetaData, not_, inspect
 from sqlalchemy.exc import SQLAlchemyError
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote_plus
 from datetime import datetime, timedelta
 import pandas as pd
 from models import metadata, games_atp, players_atp, tours_atp, stat_atp, ratings_atp, odds_atp, today_atp
+from mirror import access_url, mirror_url, mirror_path
+from queryCache import QueryCache
+from timings import timed, stage, instrument_engine
 
-db_path = os.environ.get('ONCOURT_DB_PATH')
-db_password = os.environ.get('ONCOURT_DB_PASSWORD')
-conn_str = f"access+pyodbc:///?odbc_connect=DRIVER={{Microsoft Access Driver (*.mdb, *.accdb)}};DBQ={db_path};PWD={db_password}"
-engine = create_engine(conn_str)
+# 'access' reads the OnCourt file through pyodbc, 'mirror' reads the local copy built by mirror.py
+backend = os.environ.get('ONCOURT_BACKEND', 'access')
 
-def get_table(tour, table_name):
-    if tour == 'atp':
-        return Table(f'{table_name}_atp', metadata, autoload_with=engine)
-    elif tour == 'wta':
-        return Table(f'{table_name}_wta', metadata, autoload_with=engine)
+pool_options = {
+    'pool_size': int(os.environ.get('ONCOURT_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('ONCOURT_POOL_MAX_OVERFLOW', 5)),
+    'pool_pre_ping': os.environ.get('ONCOURT_POOL_PRE_PING', '1') == '1',
+    'pool_recycle': int(os.environ.get('ONCOURT_POOL_RECYCLE', 3600)),
+}
+
+def make_engine(backend_name=None, **options):
+    """Builds a read-only engine for the given backend. options override pool_options."""
+    backend_name = backend_name or backend
+    options = {**pool_options, **options}
+    if backend_name == 'access':
+        return instrument_engine(create_engine(access_url(read_only=True), **options))
+    elif backend_name == 'mirror':
+        return instrument_engine(create_engine(mirror_url(read_only=True), **options))
     else:
+        raise ValueError(f"Invalid backend specified: {backend_name}")
+
+# created on first use so importing this module never touches the DB
+engine = None
+engine_lock = threading.Lock()
+
+def get_engine():
+    global engine
+    if engine is None:
+        with engine_lock:
+            if engine is None:
+                engine = make_engine()
+    return engine
+
+def dispose_engine():
+    global engine
+    with engine_lock:
+        if engine is not None:
+            engine.dispose()
+            engine = None
+        clear_schema_registry()
+
+def db_file_stamp():
+    """(mtime, size) of the file the current backend reads, or None if it cannot be stat'ed."""
+    path = mirror_path() if backend == 'mirror' else os.environ.get('ONCOURT_DB_PATH')
+    try:
+        stat = os.stat(path)
+    except (TypeError, OSError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+query_cache = QueryCache(
+    maxsize=int(os.environ.get('ONCOURT_CACHE_SIZE', 128)),
+    ttl=float(os.environ.get('ONCOURT_CACHE_TTL', 600)),
+    max_bytes=int(float(os.environ.get('ONCOURT_CACHE_MB', 256)) * 2**20),
+    stamp=db_file_stamp
+)
+
+SURFACES = {1: 'hard', 2: 'clay', 3: 'indoor hard', 4: 'carpet', 5: 'grass', 6: 'acrylic'}
+SURFACE_CODES = {name: code for code, name in SURFACES.items()}
+surface_dtype = pd.CategoricalDtype(list(SURFACES.values()))
+
+# columns shrunk by compact_frame; anything else keeps the dtype the driver gave it
+ID_COLUMNS = ['ID1_G', 'ID2_G', 'ID_T_G', 'ID_R_G', 'ID1', 'ID2', 'ID_T', 'ID_R', 'ID_P', 'tournament_rank']
+NAME_COLUMNS = ['player1_name', 'player2_name', 'winnerName', 'loserName', 'Player1', 'Player2',
+                'tournament_name', 'tournament_country', 'Tournament']
+
+def decode_surface(codes):
+    """Maps ID_C_T codes to a Categorical of surface names; unknown codes become NaN."""
+    return codes.map(SURFACES).astype(surface_dtype)
+
+def compact_frame(frame):
+    for column in ID_COLUMNS:
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype('Int32')
+    for column in NAME_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype('category')
+    return frame
+
+def singles_filter(*player_tables):
+    """WHERE clause dropping doubles pairs, whose NAME_P is written 'A/B'."""
+    return and_(*[not_(player.c.NAME_P.like('%/%')) for player in player_tables])
+
+# table name -> Table, filled on first use so each table is checked against the DB once per process
+schema_registry = {}
+
+def schema_fingerprint(column_names):
+    return tuple(sorted(str(name).upper() for name in column_names))
+
+@timed()
+def register_table(table_name):
+    """
+    Returns the static definition from models.py if the live column set still matches it.
+    On drift it warns and reflects the live table instead, so queries keep working.
+    """
+    live_columns = [column['name'] for column in inspect(get_engine()).get_columns(table_name)]
+    static_table = metadata.tables.get(table_name)
+    if static_table is not None and schema_fingerprint(static_table.columns.keys()) == schema_fingerprint(live_columns):
+        return static_table
+    print(f"Schema drift detected for {table_name}, reflecting the live table")
+    return Table(table_name, MetaData(), autoload_with=get_engine())
+
+def clear_schema_registry():
+    schema_registry.clear()
+
+def get_table(tour, table_name):
+    if tour not in ('atp', 'wta'):
         raise ValueError("Invalid tour specified")
+    full_name = f'{table_name}_{tour}'
+    table = schema_registry.get(full_name)
+    if table is None:
+        table = register_table(full_name)
+        schema_registry[full_name] = table
+    return table
 
+@timed(first_arg='tour')
+@query_cache.cached
 def get_player_id(tour, player_name):
     try:
         players_table = get_table(tour, 'players')
         query = select(players_table.c.ID_P).where(players_table.c.NAME_P == player_name)
         
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             player_id = result.scalar()
             return player_id
@@ -32,57 +141,106 @@ def get_player_id(tour, player_name):
         print(f"An error occurred: {e}")
         return None
 
-get_player_id('wta', 'Serena Williams')
+@timed(first_arg='tour')
+@query_cache.cached
+def get_players(tour, singles_only=True):
+    """All ID_P/NAME_P pairs of a tour, for building in-memory name lookups."""
+    try:
+        players_table = get_table(tour, 'players')
+        query = select(players_table.c.ID_P, players_table.c.NAME_P)
+        if singles_only:
+            query = query.where(singles_filter(players_table))
 
-def get_matches_in_daterange(tour, start_date, end_date=None, singles_only=True):
+        with get_engine().connect() as connection:
+            result = connection.execute(query)
+            return pd.DataFrame(result.fetchall(), columns=result.keys())
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+def matches_in_daterange_query(tour, start_date, end_date=None, singles_only=True):
     if end_date is None:
         end_date = datetime.now() - timedelta(days=1)
     
     start_date_str = start_date.strftime('%Y-%m-%d')
     end_date_str = end_date.strftime('%Y-%m-%d')
 
-    try:
-        games_table = get_table(tour, 'games')
-        players_table = get_table(tour, 'players')
-        tours_table = get_table(tour, 'tours')
+    games_table = get_table(tour, 'games')
+    players_table = get_table(tour, 'players')
+    tours_table = get_table(tour, 'tours')
 
-        player1 = alias(players_table, name='player1')
-        player2 = alias(players_table, name='player2')
-
-        query = select(
-            games_table.c.ID1_G,
-            games_table.c.ID2_G,
-            games_table.c.DATE_G,
-            player1.c.NAME_P.label('player1_name'),
-            player2.c.NAME_P.label('player2_name'),
-            tours_table.c.NAME_T.label('tournament_name'),
-            tours_table.c.ID_C_T.label('surface'),
-            tours_table.c.RANK_T.label('tournament_rank')
-        ).select_from(
-            games_table.join(player1, games_table.c.ID1_G == player1.c.ID_P)
-                       .join(player2, games_table.c.ID2_G == player2.c.ID_P)
-                       .join(tours_table, games_table.c.ID_T_G == tours_table.c.ID_T)
-        ).where(
-            and_(
-                games_table.c.DATE_G >= start_date_str,
-                games_table.c.DATE_G <= end_date_str
-            )
+    player1 = alias(players_table, name='player1')
+    player2 = alias(players_table, name='player2')
+
+    query = select(
+        games_table.c.ID1_G,
+        games_table.c.ID2_G,
+        games_table.c.ID_T_G,
+        games_table.c.ID_R_G,
+        games_table.c.DATE_G,
+        player1.c.NAME_P.label('player1_name'),
+        player2.c.NAME_P.label('player2_name'),
+        tours_table.c.NAME_T.label('tournament_name'),
+        tours_table.c.ID_C_T.label('surface'),
+        tours_table.c.RANK_T.label('tournament_rank')
+    ).select_from(
+        games_table.join(player1, games_table.c.ID1_G == player1.c.ID_P)
+                   .join(player2, games_table.c.ID2_G == player2.c.ID_P)
+                   .join(tours_table, games_table.c.ID_T_G == tours_table.c.ID_T)
+    ).where(
+        and_(
+            games_table.c.DATE_G >= start_date_str,
+            games_table.c.DATE_G <= end_date_str
         )
-        if singles_only:
-            query = query.where(
-                not_(player1.c.NAME_P.like('%/%'))
-            )
+    )
+    if singles_only:
+        query = query.where(singles_filter(player1, player2))
+    return query
 
-        with engine.connect() as connection:
+@timed(first_arg='tour')
+@query_cache.cached
+def get_matches_in_daterange(tour, start_date, end_date=None, singles_only=True):
+    try:
+        query = matches_in_daterange_query(tour, start_date, end_date, singles_only)
+
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             matches = pd.DataFrame(result.fetchall(), columns=result.keys())
-            matches['surface'] = matches['surface'].map({1: 'hard', 2: 'clay', 3: 'indoor hard', 4: 'carpet', 5: 'grass', 6: 'acrylic'})
+            matches['surface'] = decode_surface(matches['surface'])
         
-            return matches
+            return compact_frame(matches)
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         return None
 
+def iter_matches_in_daterange(tour, start_date, end_date=None, singles_only=True, chunk_size=50_000):
+    """
+    Streaming version of get_matches_in_daterange. Yields DataFrames of at most chunk_size rows
+    in DATE_G order, so a full-history pull never holds more than one chunk in memory.
+    Unlike the get_* functions, a SQLAlchemyError is raised rather than returned as None.
+    """
+    try:
+        query = matches_in_daterange_query(tour, start_date, end_date, singles_only)
+        query = query.order_by(query.selected_columns.DATE_G)
+
+        with get_engine().connect() as connection:
+            result = connection.execution_options(yield_per=chunk_size).execute(query)
+            columns = list(result.keys())
+            for rows in result.partitions():
+                # timed per chunk, outside the yield, so consumer time is not counted
+                with stage('iter_matches_in_daterange.chunk', tour=tour) as record:
+                    matches = pd.DataFrame(rows, columns=columns)
+                    matches['surface'] = decode_surface(matches['surface'])
+                    matches = compact_frame(matches)
+                    record['rows'] = len(matches)
+                yield matches
+    except SQLAlchemyError as e:
+        # re-raised: a stream cut short by the DB must not pass for a complete one
+        print(f"An error occurred: {e}")
+        raise
+
+@timed(first_arg='tour')
+@query_cache.cached
 def get_tournaments_in_daterange(tour, start_date, end_date=None):
     """
     Retrieves tournaments within a specified date range from the 'tours' table.
@@ -107,7 +265,7 @@ def get_tournaments_in_daterange(tour, start_date, end_date=None):
             )
         )
 
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             tournaments = pd.DataFrame(result.fetchall(), columns=result.keys())
             return tournaments
@@ -115,41 +273,68 @@ def get_tournaments_in_daterange(tour, start_date, end_date=None):
         print(f"An error occurred: {e}")
         return None
     
+def matches_in_tournament_query(tour, tournament_ids, singles_only=True):
+    games_table = get_table(tour, 'games')
+    players_table = get_table(tour, 'players')
+    tours_table = get_table(tour, 'tours')
+
+    player1 = alias(players_table, name='player1')
+    player2 = alias(players_table, name='player2')
+
+    query = select(
+        games_table,
+        tours_table.c.NAME_T.label('tournament_name'),
+        tours_table.c.COUNTRY_T.label('tournament_country'),
+        player1.c.NAME_P.label('winnerName'),
+        player2.c.NAME_P.label('loserName')
+    ).select_from(
+        games_table.join(tours_table, games_table.c.ID_T_G == tours_table.c.ID_T)
+                   .join(player1, games_table.c.ID1_G == player1.c.ID_P)
+                   .join(player2, games_table.c.ID2_G == player2.c.ID_P)
+    ).where(
+        games_table.c.ID_T_G.in_(tournament_ids)
+    )
+    if singles_only:
+        query = query.where(singles_filter(player1, player2))
+    return query
+
+@timed(first_arg='tour')
+@query_cache.cached
 def get_matches_in_tournament(tour, tournament_ids, singlesOnly=True):
     try:
-        games_table = get_table(tour, 'games')
-        players_table = get_table(tour, 'players')
-        tours_table = get_table(tour, 'tours')
+        query = matches_in_tournament_query(tour, tournament_ids, singlesOnly)
 
-        player1 = alias(players_table, name='player1')
-        player2 = alias(players_table, name='player2')
-
-        query = select(
-            games_table,
-            tours_table.c.NAME_T.label('tournament_name'),
-            tours_table.c.COUNTRY_T.label('tournament_country'),
-            player1.c.NAME_P.label('winnerName'),
-            player2.c.NAME_P.label('loserName')
-        ).select_from(
-            games_table.join(tours_table, games_table.c.ID_T_G == tours_table.c.ID_T)
-                       .join(player1, games_table.c.ID1_G == player1.c.ID_P)
-                       .join(player2, games_table.c.ID2_G == player2.c.ID_P)
-        ).where(
-            games_table.c.ID_T_G.in_(tournament_ids)
-        )
-
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             matches = pd.DataFrame(result.fetchall(), columns=result.keys())
+            return compact_frame(matches)
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
 
-            if singlesOnly:
-                matches = matches[~matches['winnerName'].str.contains('/') & ~matches['loserName'].str.contains('/')]
+def iter_matches_in_tournament(tour, tournament_ids, singlesOnly=True, chunk_size=50_000):
+    """
+    Streaming version of get_matches_in_tournament, yielding DataFrames of at most chunk_size
+    rows. A SQLAlchemyError is raised, as in iter_matches_in_daterange.
+    """
+    try:
+        query = matches_in_tournament_query(tour, tournament_ids, singlesOnly)
 
-            return matches
+        with get_engine().connect() as connection:
+            result = connection.execution_options(yield_per=chunk_size).execute(query)
+            columns = list(result.keys())
+            for rows in result.partitions():
+                with stage('iter_matches_in_tournament.chunk', tour=tour) as record:
+                    matches = compact_frame(pd.DataFrame(rows, columns=columns))
+                    record['rows'] = len(matches)
+                yield matches
     except SQLAlchemyError as e:
+        # re-raised: a stream cut short by the DB must not pass for a complete one
         print(f"An error occurred: {e}")
-        return None
+        raise
 
+@timed(first_arg='tour')
+@query_cache.cached
 def get_match_stats(tour, id1, id2, tournament_id):
     try:
         stat_table = get_table(tour, 'stat')
@@ -164,7 +349,7 @@ def get_match_stats(tour, id1, id2, tournament_id):
             )
         )
         
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             stats = pd.DataFrame(result.fetchall(), columns=result.keys())
             return stats
@@ -172,49 +357,230 @@ def get_match_stats(tour, id1, id2, tournament_id):
         print(f"An error occurred: {e}")
         return None
     
-def get_upcoming_matches(tour, remove_doubles=True):
+def swap_stat_sides(stats):
+    """Renames the _1/_2 and ID1/ID2 columns of a stat frame so the rows read from the other player's side."""
+    mapping = {'ID1': 'ID2', 'ID2': 'ID1'}
+    for column in stats.columns:
+        if column.endswith('_1'):
+            mapping[column] = column[:-2] + '_2'
+        elif column.endswith('_2'):
+            mapping[column] = column[:-2] + '_1'
+    return stats.rename(columns=mapping)
+
+@timed(first_arg='tour')
+@query_cache.cached
+def get_match_stats_bulk(tour, keys, key_columns=('ID1_G', 'ID2_G', 'ID_T_G', 'ID_R_G'), batch_size=500):
+    """
+    Bulk version of get_match_stats.
+
+    Args:
+        keys (DataFrame or list): (id1, id2, tournament_id) triples, or (id1, id2, tournament_id,
+            round_id) quadruples. For a DataFrame, key_columns name them; the round column is
+            used when the frame has it.
+        batch_size (int): Tournament ids per IN-query.
+
+    Returns one row per key in input order, oriented so the _1 columns belong to id1.
+    Keys without a stat row come back as NaN. With the round in the key, two players who
+    meet twice in one event (round robin, then the final) get each match's own stats.
+    """
+    if isinstance(keys, pd.DataFrame):
+        key_columns = [column for column in key_columns if column in keys.columns]
+        key_frame = keys[key_columns].copy()
+    else:
+        key_frame = pd.DataFrame(list(keys))
+        if key_frame.empty:
+            # no keys still gives the stat_* columns, with no rows
+            key_frame = key_frame.reindex(columns=range(3))
+    key_frame.columns = ['ID1', 'ID2', 'ID_T', 'ID_R'][:key_frame.shape[1]]
+    on = list(key_frame.columns)
+
+    try:
+        stat_table = get_table(tour, 'stat')
+        tournament_ids = sorted(set(key_frame['ID_T'].dropna().astype(int)))
+
+        frames = []
+        with get_engine().connect() as connection:
+            for start in range(0, len(tournament_ids), batch_size):
+                query = select(stat_table).where(stat_table.c.ID_T.in_(tournament_ids[start:start + batch_size]))
+                result = connection.execute(query)
+                frames.append(pd.DataFrame(result.fetchall(), columns=result.keys()))
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+    if frames:
+        stats = pd.concat(frames, ignore_index=True)
+    else:
+        stats = pd.DataFrame(columns=[column.name for column in stat_table.columns])
+    oriented = pd.concat([stats, swap_stat_sides(stats)], ignore_index=True)
+    oriented = oriented.drop_duplicates(subset=on, keep='first')
+
+    key_frame = key_frame.astype('Int64')
+    oriented = oriented.astype({column: 'Int64' for column in on})
+    aligned = key_frame.merge(oriented, how='left', on=on)
+    aligned.index = key_frame.index
+    return aligned[stats.columns]
+
+@timed(first_arg='tour')
+@query_cache.cached
+def get_rankings(tour, start_date=None):
+    """Weekly ranking snapshots from ratings_* (DATE_R, ID_P_R, POINT_R, POS_R), optionally from start_date on."""
+    try:
+        ratings_table = get_table(tour, 'ratings')
+        query = select(ratings_table)
+        if start_date is not None:
+            query = query.where(ratings_table.c.DATE_R >= start_date.strftime('%Y-%m-%d'))
+
+        with get_engine().connect() as connection:
+            result = connection.execute(query)
+            rankings = pd.DataFrame(result.fetchall(), columns=result.keys())
+            rankings['ID_P_R'] = rankings['ID_P_R'].astype('Int32')
+            return rankings
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+@timed(first_arg='tour')
+@query_cache.cached
+def get_odds(tour, tournament_ids, batch_size=500):
+    """Every bookmaker's K1/K2 row from odds_* for the given tournaments."""
     try:
-        today_table = get_table(tour, 'today')
-        players_table = get_table(tour, 'players')
         odds_table = get_table(tour, 'odds')
-        tours_table = get_table(tour, 'tours')
+        tournament_ids = sorted(set(int(tournament_id) for tournament_id in tournament_ids))
 
-        player1 = alias(players_table, name='player1')
-        player2 = alias(players_table, name='player2')
-
-        query = select(
-            today_table,
-            player1.c.NAME_P.label('Player1'),
-            player2.c.NAME_P.label('Player2'),
-            odds_table.c.K1.label('P1_Odds'),
-            odds_table.c.K2.label('P2_Odds'),
-            tours_table.c.ID_C_T.label('Surface'),
-            tours_table.c.NAME_T.label('Tournament')
-        ).select_from(
-            today_table.join(player1, today_table.c.ID1 == player1.c.ID_P)
-                       .join(player2, today_table.c.ID2 == player2.c.ID_P)
-                       .outerjoin(odds_table, and_(
-                           today_table.c.ID1 == odds_table.c.ID1_O,
-                           today_table.c.ID2 == odds_table.c.ID2_O
-                       ))
-                       .join(tours_table, today_table.c.TOUR == tours_table.c.ID_T) 
-        ).where(
-            today_table.c.DATE_GAME >= datetime.now()
-        ).order_by(
-            (odds_table.c.K1 + odds_table.c.K2).desc()
-        )
+        frames = []
+        with get_engine().connect() as connection:
+            for start in range(0, len(tournament_ids), batch_size):
+                query = select(
+                    odds_table.c.ID_B_O, odds_table.c.ID1_O, odds_table.c.ID2_O,
+                    odds_table.c.ID_T_O, odds_table.c.ID_R_O, odds_table.c.K1, odds_table.c.K2
+                ).where(
+                    and_(
+                        odds_table.c.ID_T_O.in_(tournament_ids[start:start + batch_size]),
+                        odds_table.c.K1 > 1,
+                        odds_table.c.K2 > 1
+                    )
+                )
+                result = connection.execute(query)
+                frames.append(pd.DataFrame(result.fetchall(), columns=result.keys()))
 
-        with engine.connect() as connection:
+        if not frames:
+            return pd.DataFrame(columns=['ID_B_O', 'ID1_O', 'ID2_O', 'ID_T_O', 'ID_R_O', 'K1', 'K2'])
+        return pd.concat(frames, ignore_index=True)
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+def aggregate_odds(odds):
+    """
+    Collapses bookmaker rows to one row per (ID1, ID2, ID_T, ID_R) with the best and median
+    prices, the consensus probability (mean of each bookmaker's margin-free probability) and
+    the number of bookmakers. Rows are emitted for both player orders so either side can
+    join. The round keeps two meetings in one event apart; it is left out of the key when
+    odds has no ID_R_O column.
+    """
+    implied1, implied2 = 1 / odds['K1'], 1 / odds['K2']
+    sides = pd.DataFrame({
+        'ID1': odds['ID1_O'], 'ID2': odds['ID2_O'], 'ID_T': odds['ID_T_O'], 'ID_B': odds['ID_B_O'],
+        'K1': odds['K1'], 'K2': odds['K2'], 'P1': implied1 / (implied1 + implied2),
+    })
+    keys = ['ID1', 'ID2', 'ID_T']
+    if 'ID_R_O' in odds.columns:
+        sides['ID_R'] = odds['ID_R_O']
+        keys.append('ID_R')
+    swapped = sides.rename(columns={'ID1': 'ID2', 'ID2': 'ID1', 'K1': 'K2', 'K2': 'K1'})
+    swapped['P1'] = 1 - swapped['P1']
+    sides = pd.concat([sides, swapped], ignore_index=True)
+
+    summary = sides.groupby(keys, dropna=False).agg(
+        P1_Odds=('K1', 'max'),
+        P2_Odds=('K2', 'max'),
+        P1_Median_Odds=('K1', 'median'),
+        P2_Median_Odds=('K2', 'median'),
+        P1_Consensus=('P1', 'mean'),
+        Bookmakers=('ID_B', 'nunique'),
+    ).reset_index()
+    summary['P2_Consensus'] = 1 - summary['P1_Consensus']
+    return summary
+
+def today_query(tour, remove_doubles=True):
+    """today_* rows with player names and the tournament's surface, name and rank; callers add the WHERE."""
+    today_table = get_table(tour, 'today')
+    players_table = get_table(tour, 'players')
+    tours_table = get_table(tour, 'tours')
+
+    player1 = alias(players_table, name='player1')
+    player2 = alias(players_table, name='player2')
+
+    query = select(
+        today_table,
+        player1.c.NAME_P.label('Player1'),
+        player2.c.NAME_P.label('Player2'),
+        tours_table.c.ID_C_T.label('Surface'),
+        tours_table.c.NAME_T.label('Tournament'),
+        tours_table.c.RANK_T.label('Tournament Rank')
+    ).select_from(
+        today_table.join(player1, today_table.c.ID1 == player1.c.ID_P)
+                   .join(player2, today_table.c.ID2 == player2.c.ID_P)
+                   .join(tours_table, today_table.c.TOUR == tours_table.c.ID_T)
+    )
+    if remove_doubles:
+        query = query.where(singles_filter(player1, player2))
+    return query
+
+@timed(first_arg='tour')
+@query_cache.cached
+def get_upcoming_matches(tour, remove_doubles=True):
+    try:
+        query = today_query(tour, remove_doubles).where(get_table(tour, 'today').c.DATE_GAME >= datetime.now())
+
+        with get_engine().connect() as connection:
             result = connection.execute(query)
             today = pd.DataFrame(result.fetchall(), columns=result.keys())
-                
-        if remove_doubles:
-            today = today[~today['Player1'].str.contains('/') & ~today['Player2'].str.contains('/')]
-        today['Surface'] = today['Surface'].map({1: 'hard', 2: 'clay', 3: 'indoor hard', 4: 'carpet', 5: 'grass', 6: 'acrylic'})
-        today = today.drop_duplicates(subset=['ID1', 'ID2', 'DATE_GAME'], keep='first')
-        
-        return today
     except SQLAlchemyError as e:
         print(f"An error occurred: {e}")
         return None
-    
+
+    today['Surface'] = decode_surface(today['Surface'])
+    today = compact_frame(today)
+
+    tournament_ids = pd.to_numeric(today['TOUR'], errors='coerce').astype('Int32')
+    odds = get_odds(tour, tournament_ids.dropna().unique().tolist())
+    if odds is None:
+        return None
+    market = aggregate_odds(odds).astype({'ID1': 'Int32', 'ID2': 'Int32', 'ID_T': 'Int32', 'ID_R': 'Int32'})
+    rounds = pd.to_numeric(today['ROUND'], errors='coerce').astype('Int32')
+    today = today.assign(ID_T=tournament_ids, ID_R=rounds).merge(
+        market, how='left', on=['ID1', 'ID2', 'ID_T', 'ID_R']
+    ).drop(columns=['ID_T', 'ID_R'])
+
+    return today.sort_values(by='P1_Odds', key=lambda odds: odds + today['P2_Odds'],
+                             ascending=False, na_position='last', ignore_index=True)
+
+@timed(first_arg='tour')
+@query_cache.cached
+def get_draw(tour, tournament_id, remove_doubles=True):
+    """Every today_* row of one tournament (all rounds, played or not) with names and surface."""
+    try:
+        query = today_query(tour, remove_doubles).where(get_table(tour, 'today').c.TOUR == str(tournament_id))
+
+        with get_engine().connect() as connection:
+            result = connection.execute(query)
+            draw = pd.DataFrame(result.fetchall(), columns=result.keys())
+    except SQLAlchemyError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+    draw['Surface'] = decode_surface(draw['Surface'])
+    for column in ('ROUND', 'DRAW'):
+        draw[column] = pd.to_numeric(draw[column], errors='coerce').astype('Int32')
+    return compact_frame(draw)
+
+def fetch_tours(func, *args, tours=('atp', 'wta'), **kwargs):
+    """
+    Runs func(tour, *args, **kwargs) for each tour on a thread pool, e.g.
+    fetch_tours(get_upcoming_matches) -> {'atp': DataFrame, 'wta': DataFrame}.
+    """
+    with ThreadPoolExecutor(max_workers=len(tours)) as pool:
+        futures = {tour: pool.submit(func, tour, *args, **kwargs) for tour in tours}
+        return {tour: future.result() for tour, future in futures.items()}
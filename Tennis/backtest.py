@@ -0,0 +1,167 @@
+"""
+Walk-forward backtest of the Elo prices against the market.
+
+Matches are replayed in date order through a fresh EloEngine, so every probability is the
+one the model would have quoted before the match. Closing prices are pulled for all
+evaluated tournaments in one batched query and collapsed per match with
+accessDB.aggregate_odds. Everything after that is vectorised over the whole frame.
+
+The staking rule is the one the app highlights in format_player_name: back a player when
+the model's probability beats the market's by more than `edge`.
+
+    python backtest.py --tour atp --start 2014-01-01 --warmup-years 3
+"""
+import argparse
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from accessDB import iter_matches_in_daterange, get_odds, aggregate_odds
+from eloEngine import EloEngine
+from timings import profile
+
+
+def replay_matches(tour: str, start_date: datetime, end_date: datetime = None, warmup_start: datetime = None,
+                   k_factor: float = 32) -> pd.DataFrame:
+    """
+    Fits a fresh model from warmup_start (defaults to start_date) and returns the matches from
+    start_date on with the winner's pre-match overall and surface probabilities attached.
+    """
+    engine = EloEngine(k_factor=k_factor)
+    frames = []
+    for matches in iter_matches_in_daterange(tour, warmup_start or start_date, end_date):
+        # drop rows the engine has already applied up front, so the probabilities line up
+        matches = engine.new_matches(matches)
+        overall_probs, surface_probs = engine.fit(matches)
+        matches = matches.assign(p_overall=overall_probs, p_surface=surface_probs)
+        frames.append(matches[matches['DATE_G'] >= start_date])
+    if not frames:
+        return pd.DataFrame()
+    replayed = pd.concat(frames, ignore_index=True)
+    replayed['p_surface'] = replayed['p_surface'].fillna(replayed['p_overall'])
+    return replayed
+
+
+def attach_market(replayed: pd.DataFrame, tour: str) -> pd.DataFrame:
+    """Joins best/median closing prices and the consensus probability, oriented winner first."""
+    odds = get_odds(tour, replayed['ID_T_G'].dropna().unique().tolist())
+    if odds is None:
+        raise ValueError(f"Could not load {tour} odds")
+    market = aggregate_odds(odds).rename(columns={'ID1': 'ID1_G', 'ID2': 'ID2_G', 'ID_T': 'ID_T_G', 'ID_R': 'ID_R_G'})
+    market = market.astype({'ID1_G': 'Int32', 'ID2_G': 'Int32', 'ID_T_G': 'Int32', 'ID_R_G': 'Int32'})
+    replayed = replayed.astype({'ID_R_G': 'Int32'})
+    return replayed.merge(market, how='left', on=['ID1_G', 'ID2_G', 'ID_T_G', 'ID_R_G'])
+
+
+def both_sides(frame: pd.DataFrame, model_column: str, price: str = 'median') -> pd.DataFrame:
+    """One row per player per match: model and market probability, decimal price and result."""
+    winner_price, loser_price = ('P1_Median_Odds', 'P2_Median_Odds') if price == 'median' else ('P1_Odds', 'P2_Odds')
+    winners = pd.DataFrame({
+        'model': frame[model_column].to_numpy(),
+        'market': frame['P1_Consensus'].to_numpy(dtype=float, na_value=np.nan),
+        'odds': frame[winner_price].to_numpy(dtype=float, na_value=np.nan),
+        'won': 1,
+    })
+    losers = pd.DataFrame({
+        'model': 1 - frame[model_column].to_numpy(),
+        'market': frame['P2_Consensus'].to_numpy(dtype=float, na_value=np.nan),
+        'odds': frame[loser_price].to_numpy(dtype=float, na_value=np.nan),
+        'won': 0,
+    })
+    return pd.concat([winners, losers], ignore_index=True)
+
+
+def log_loss(winner_probs) -> float:
+    probs = np.clip(np.asarray(winner_probs, dtype=float), 1e-12, 1 - 1e-12)
+    return float(-np.mean(np.log(probs)))
+
+
+def calibration_table(frame: pd.DataFrame, model_column: str = 'p_overall', bins: int = 10) -> pd.DataFrame:
+    """Predicted vs observed win rate by probability bucket, counting both players of every match."""
+    sides = both_sides(frame, model_column)
+    buckets = pd.cut(sides['model'], np.linspace(0, 1, bins + 1), include_lowest=True)
+    table = sides.groupby(buckets, observed=True).agg(
+        predicted=('model', 'mean'), observed=('won', 'mean'), count=('won', 'size'),
+        market=('market', 'mean'),
+    )
+    return table.reset_index(names='bucket')
+
+
+def staking_returns(frame: pd.DataFrame, model_column: str = 'p_overall', edge: float = 0.03,
+                    price: str = 'median', kelly_fraction: float = 1.0) -> Dict[str, float]:
+    """
+    Flat (1 unit) and Kelly returns of the "model > market + edge" rule. Kelly stakes are a
+    fraction of a fixed 1-unit bankroll per bet, not compounded, so bets stay independent.
+    """
+    sides = both_sides(frame, model_column, price).dropna()
+    bets = sides[(sides['model'] > sides['market'] + edge) & (sides['odds'] > 1)]
+    payout = np.where(bets['won'] == 1, bets['odds'] - 1, -1.0)
+
+    kelly_stakes = kelly_fraction * np.clip((bets['model'] * bets['odds'] - 1) / (bets['odds'] - 1), 0, 1)
+    flat_profit = float(payout.sum())
+    kelly_profit = float((kelly_stakes * payout).sum())
+    return {
+        'bets': int(len(bets)),
+        'hit_rate': float(bets['won'].mean()) if len(bets) else float('nan'),
+        'flat_staked': float(len(bets)),
+        'flat_profit': flat_profit,
+        'flat_roi': flat_profit / len(bets) if len(bets) else float('nan'),
+        'kelly_staked': float(kelly_stakes.sum()),
+        'kelly_profit': kelly_profit,
+        'kelly_roi': kelly_profit / kelly_stakes.sum() if kelly_stakes.sum() else float('nan'),
+    }
+
+
+def summarize(frame: pd.DataFrame, edge: float = 0.03, price: str = 'median') -> Dict[str, Dict[str, float]]:
+    priced = frame[frame['P1_Consensus'].notna()]
+    summary = {
+        'matches': {'all': int(len(frame)), 'with_odds': int(len(priced))},
+        'log_loss': {
+            'overall_all': log_loss(frame['p_overall']),
+            'surface_all': log_loss(frame['p_surface']),
+            'overall': log_loss(priced['p_overall']),
+            'surface': log_loss(priced['p_surface']),
+            'market': log_loss(priced['P1_Consensus']),
+        },
+    }
+    for model_column in ('p_overall', 'p_surface'):
+        summary[f'staking_{model_column}'] = staking_returns(priced, model_column, edge, price)
+    return summary
+
+
+def run_backtest(tour: str, start_date: datetime, end_date: datetime = None, warmup_years: int = 3,
+                 k_factor: float = 32, edge: float = 0.03, price: str = 'median'):
+    """Returns (per-match frame, summary dict)."""
+    warmup_start = start_date.replace(year=start_date.year - warmup_years)
+    frame = replay_matches(tour, start_date, end_date, warmup_start, k_factor)
+    if frame.empty:
+        raise ValueError(f"No {tour} matches found from {start_date}")
+    frame = attach_market(frame, tour)
+    return frame, summarize(frame, edge, price)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the Elo model against closing odds")
+    parser.add_argument('--tour', choices=['atp', 'wta'], default='wta')
+    parser.add_argument('--start', default='2015-01-01')
+    parser.add_argument('--end', default=None, help="defaults to yesterday")
+    parser.add_argument('--warmup-years', type=int, default=3)
+    parser.add_argument('--k-factor', type=float, default=32)
+    parser.add_argument('--edge', type=float, default=0.03)
+    parser.add_argument('--price', choices=['median', 'best'], default='median')
+    args = parser.parse_args()
+
+    with profile('backtest'):
+        frame, summary = run_backtest(
+            args.tour,
+            datetime.strptime(args.start, '%Y-%m-%d'),
+            datetime.strptime(args.end, '%Y-%m-%d') if args.end else None,
+            args.warmup_years, args.k_factor, args.edge, args.price
+        )
+    for section, values in summary.items():
+        print(section)
+        for name, value in values.items():
+            print(f"  {name}: {value:.4f}" if isinstance(value, float) else f"  {name}: {value}")
+    print(calibration_table(frame[frame['P1_Consensus'].notna()]).to_string(index=False))
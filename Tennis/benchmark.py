@@ -0,0 +1,287 @@
+"""
+Benchmarks for the Elo and pricing hot paths on synthetic data, so they can be run
+without an OnCourt DB.
+
+make_matches builds a frame shaped like get_matches_in_daterange: tournaments of
+draw-sized blocks of matches spread over the seasons, each with one surface and
+tournament rank, between players whose latent strength decides who wins. Each size
+is then run through the stages below:
+
+    encode          EloEngine.encode
+    fit_engine      EloEngine.fit, with history
+    fit_reference   the original load_data loop over EloModel (first reference_limit matches)
+    fit_systems     MultiRatingEngine.process with the default systems
+    as_of           EloEngine.ratings_as_of for both players of every match
+    save / load     modelStore.save_model / load_model (memory-mapped)
+    pickle_*        pickle.dump / load of the fitted EloEngine, for comparison
+    predict_many    one call over a million pairs
+    price_matches   streamlit_app.price_matches on a card, repeated for latency percentiles
+
+Every stage reports seconds, rows/s and peak traced memory (from a second, traced run).
+Repeated stages also report p50/p95 latency. Each run appends one JSON line to the
+output file (--output, or ONCOURT_BENCHMARK_PATH, default benchmarks.jsonl) with the
+commit it ran on, so results can be compared across commits.
+
+    python benchmark.py --size small --size medium
+    python benchmark.py --matches 2000000 --players 50000 --no-memory
+"""
+import argparse
+import importlib
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from accessDB import SURFACES
+from eloEngine import EloEngine
+from modelStore import save_model, load_model
+from ratingSystems import MultiRatingEngine
+
+SIZES = {
+    'small': (10_000, 1_000),
+    'medium': (500_000, 20_000),
+    'large': (5_000_000, 100_000),
+}
+# share of matches by ID_C_T code, roughly the tour mix over the last decades
+SURFACE_SHARES = {1: 0.52, 2: 0.30, 3: 0.09, 4: 0.02, 5: 0.06, 6: 0.01}
+DRAW_MATCHES = 31
+
+
+def make_matches(n_matches: int, n_players: int, seed: int = 0, start_year: int = 1990) -> pd.DataFrame:
+    """A date-ordered synthetic match frame with the columns of matches_in_daterange_query."""
+    rng = np.random.default_rng(seed)
+    n_tournaments = max(1, -(-n_matches // DRAW_MATCHES))
+    years = max(1, min(35, n_matches // 60_000 + 1))
+
+    # tournaments spread over the season (January to November) of each year
+    tournament_days = np.sort(
+        (np.datetime64(f'{start_year}-01-01') - np.datetime64('1970-01-01')).astype(int)
+        + rng.integers(0, years, n_tournaments) * 365 + rng.integers(0, 320, n_tournaments)
+    )
+    codes = np.array(list(SURFACE_SHARES))
+    tournament_surfaces = rng.choice(codes, n_tournaments, p=np.array(list(SURFACE_SHARES.values())))
+    tournament_ranks = rng.choice([0, 1, 2, 3, 4, 5, 6], n_tournaments, p=[0.25, 0.25, 0.2, 0.1, 0.1, 0.05, 0.05])
+
+    tournaments = np.arange(n_matches) // DRAW_MATCHES
+    positions = np.arange(n_matches) % DRAW_MATCHES
+    # first round is 16 matches, then 8, 4, 2, 1; one day per round
+    rounds = np.searchsorted([16, 24, 28, 30], positions, side='right')
+    days = tournament_days[tournaments] + rounds
+
+    # some players play far more than others; strengths decide the winner by the Elo curve
+    activity = rng.pareto(1.5, n_players) + 1
+    players = rng.choice(n_players, size=(n_matches, 2), p=activity / activity.sum())
+    same = players[:, 0] == players[:, 1]
+    players[same, 1] = (players[same, 1] + 1) % n_players
+    strength = rng.normal(1500, 150, n_players)
+    first_wins = rng.random(n_matches) < 1 / (1 + 10 ** ((strength[players[:, 1]] - strength[players[:, 0]]) / 400))
+    winners = np.where(first_wins, players[:, 0], players[:, 1])
+    losers = np.where(first_wins, players[:, 1], players[:, 0])
+
+    names = np.array([f'Player {i}' for i in range(n_players)], dtype=object)
+    surface_names = np.array([''] + list(SURFACES.values()), dtype=object)
+    return pd.DataFrame({
+        'ID1_G': winners + 1,
+        'ID2_G': losers + 1,
+        'ID_T_G': tournaments + 1,
+        'ID_R_G': rounds + 4,
+        'DATE_G': pd.to_datetime(days, unit='D'),
+        'player1_name': names[winners],
+        'player2_name': names[losers],
+        'tournament_name': pd.Categorical(np.char.add('Tournament ', (tournaments + 1).astype(str))),
+        'surface': pd.Categorical(surface_names[tournament_surfaces[tournaments]]),
+        'tournament_rank': tournament_ranks[tournaments].astype(np.int8),
+    }).sort_values('DATE_G', kind='stable', ignore_index=True)  # tournaments overlap
+
+
+def make_card(matches: pd.DataFrame, size: int, seed: int = 0) -> pd.DataFrame:
+    """An upcoming-matches frame (get_upcoming_matches columns) drawn from the fitted players."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(matches), size)
+    picked = matches.iloc[rows]
+    consensus = rng.uniform(0.1, 0.9, size)
+    return pd.DataFrame({
+        'Player1': picked['player1_name'].to_numpy(),
+        'Player2': picked['player2_name'].to_numpy(),
+        'ID1': picked['ID1_G'].to_numpy(),
+        'ID2': picked['ID2_G'].to_numpy(),
+        'Surface': picked['surface'].astype(str).to_numpy(),
+        'Tournament': picked['tournament_name'].astype(str).to_numpy(),
+        'P1_Consensus': consensus,
+        'P2_Consensus': 1 - consensus,
+    })
+
+
+def measure(func: Callable, rows: int, repeat: int = 1, memory: bool = True) -> Dict[str, float]:
+    """
+    Times func over repeat calls, then runs it once more under tracemalloc for the peak.
+    Timing and tracing are separate because tracing slows allocation-heavy Python loops.
+    """
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    seconds = float(np.median(latencies))
+    result = {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else float('inf'),
+    }
+    if repeat > 1:
+        result['p50_ms'] = float(np.percentile(latencies, 50) * 1000)
+        result['p95_ms'] = float(np.percentile(latencies, 95) * 1000)
+    if memory:
+        tracemalloc.start()
+        func()
+        result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def fit_reference(matches: pd.DataFrame):
+    """The loop naiveElo.load_data ran before EloEngine: one pydantic Match per row."""
+    from naiveElo import EloModel, Match
+
+    model = EloModel()
+    for _, match in matches.iterrows():
+        model.add_player(match['ID1_G'], match['player1_name'])
+        model.add_player(match['ID2_G'], match['player2_name'])
+        match_obj = Match(winner=model.get_player(match['ID1_G']), loser=model.get_player(match['ID2_G']),
+                          date=match['DATE_G'])
+        model.update_elo(match_obj)
+        model.update_surface_elo(match['surface'], match_obj)
+    return model
+
+
+def load_app(model_directory: str):
+    """Imports streamlit_app with the working directory holding its elo_model_atp/wta."""
+    previous = os.getcwd()
+    os.chdir(model_directory)
+    try:
+        sys.modules.pop('streamlit_app', None)
+        return importlib.import_module('streamlit_app')
+    finally:
+        os.chdir(previous)
+
+
+def run_size(n_matches: int, n_players: int, reference_limit: int = 20_000, card_size: int = 200,
+             memory: bool = True, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    results = {}
+    started = time.perf_counter()
+    matches = make_matches(n_matches, n_players, seed)
+    results['generate'] = {'rows': n_matches, 'seconds': time.perf_counter() - started}
+
+    results['encode'] = measure(lambda: EloEngine().encode(matches), n_matches, memory=memory)
+    results['fit_engine'] = measure(lambda: EloEngine().fit(matches), n_matches, memory=memory)
+    engine = EloEngine()
+    engine.fit(matches)
+
+    reference = matches.iloc[:reference_limit]
+    results['fit_reference'] = measure(lambda: fit_reference(reference), len(reference), memory=memory)
+
+    stream = EloEngine().encode(matches)
+    results['fit_systems'] = measure(lambda: MultiRatingEngine().process(stream, engine.n_players),
+                                     n_matches, memory=memory)
+
+    engine.as_of_index()
+    results['as_of'] = measure(
+        lambda: engine.ratings_as_of(np.concatenate([matches['ID1_G'], matches['ID2_G']]),
+                                     np.concatenate([matches['DATE_G'], matches['DATE_G']])),
+        2 * n_matches, memory=memory)
+
+    directory = tempfile.mkdtemp(prefix='elo_benchmark_')
+    try:
+        path = os.path.join(directory, 'elo_model_atp')
+        results['save'] = measure(lambda: save_model(engine, path), n_matches, memory=memory)
+        shutil.copytree(path, os.path.join(directory, 'elo_model_wta'))
+        results['load'] = measure(lambda: load_model(path), engine.n_players, repeat=5, memory=memory)
+
+        pickle_path = os.path.join(directory, 'engine.pkl')
+
+        def dump():
+            with open(pickle_path, 'wb') as file:
+                pickle.dump(engine, file)
+
+        def undump():
+            with open(pickle_path, 'rb') as file:
+                return pickle.load(file)
+
+        results['pickle_save'] = measure(dump, n_matches, memory=memory)
+        results['pickle_load'] = measure(undump, engine.n_players, repeat=5, memory=memory)
+
+        pairs = np.random.default_rng(seed).integers(1, n_players + 1, size=(1_000_000, 2))
+        surfaces = np.random.default_rng(seed).choice(list(SURFACES.values()), 1_000_000)
+        results['predict_many'] = measure(lambda: engine.predict_many(pairs[:, 0], pairs[:, 1], surfaces),
+                                          len(pairs), memory=memory)
+
+        app = load_app(directory)
+        card = make_card(matches, card_size, seed)
+        model = app.elo_models['atp']
+        results['price_matches'] = measure(lambda: app.price_matches(card.copy(), model), card_size,
+                                           repeat=200, memory=memory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Elo and pricing paths on synthetic matches")
+    parser.add_argument('--size', choices=list(SIZES), action='append', help="defaults to small")
+    parser.add_argument('--matches', type=int, default=None, help="custom size, with --players")
+    parser.add_argument('--players', type=int, default=10_000)
+    parser.add_argument('--reference-limit', type=int, default=20_000,
+                        help="matches fed to the EloModel reference loop")
+    parser.add_argument('--card-size', type=int, default=200)
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced runs")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=os.environ.get('ONCOURT_BENCHMARK_PATH', 'benchmarks.jsonl'))
+    args = parser.parse_args()
+
+    sizes: List[tuple] = [(name, *SIZES[name]) for name in args.size or ([] if args.matches else ['small'])]
+    if args.matches:
+        sizes.append(('custom', args.matches, args.players))
+
+    run = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sizes': {},
+    }
+    for name, n_matches, n_players in sizes:
+        results = run_size(n_matches, n_players, args.reference_limit, args.card_size, not args.no_memory, args.seed)
+        run['sizes'][name] = {'matches': n_matches, 'players': n_players, 'stages': results}
+        print(f"{name}: {n_matches} matches, {n_players} players")
+        for stage, values in results.items():
+            line = f"  {stage:<14} {values['seconds']:9.4f}s"
+            if 'rows_per_second' in values:
+                line += f" {values['rows_per_second']:14,.0f} rows/s"
+            if 'peak_mb' in values:
+                line += f" {values['peak_mb']:9.1f} MB"
+            if 'p95_ms' in values:
+                line += f"  p50 {values['p50_ms']:.3f} ms  p95 {values['p95_ms']:.3f} ms"
+            print(line)
+
+    with open(args.output, 'a') as file:
+        file.write(json.dumps(run) + '\n')
@@ -0,0 +1,372 @@
+"""
+Array-backed Elo engine.
+
+Player ids are mapped to dense indices and ratings live in one (players x 7) float array:
+column 0 is the overall rating and columns 1-6 the surfaces, in ID_C_T code order. A fit
+encodes the match frame once into arrays of winner index, loser index, surface code and
+day, then runs one loop over them. The arithmetic is the same as EloModel.update_elo and
+EloModel.update_surface_elo, so the ratings are identical.
+
+Two settings go beyond EloModel, both off by default. start_low and start_lowest seed a
+new player by the RANK_T of their first tournament (rank 0/1 -> start_low, rank 6 ->
+start_lowest, else initial_elo), as Player.set_initial_elo intends. blend prices a match
+on blend * overall rating difference + (1 - blend) * surface difference; predict_many
+returns that as 'blend', which equals 'overall' at the default blend of 1.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from accessDB import SURFACES, SURFACE_CODES
+from features import to_days
+from ratingHistory import HistoryIndex, RatingHistory
+from timings import timed
+
+RATING_COLUMNS = ['overall', *SURFACES.values()]
+MATCH_KEY_COLUMNS = ['ID1_G', 'ID2_G', 'ID_T_G', 'ID_R_G']
+
+
+@dataclass
+class MatchStream:
+    winners: np.ndarray   # dense player index, int32
+    losers: np.ndarray    # dense player index, int32
+    surfaces: np.ndarray  # ID_C_T code, 0 when unknown, int8
+    days: np.ndarray      # days since 1970-01-01, int64
+    ranks: np.ndarray     # RANK_T of the tournament, -1 when unknown, int8
+
+    def __len__(self):
+        return len(self.winners)
+
+    @classmethod
+    def concat(cls, streams: List['MatchStream']) -> 'MatchStream':
+        """Joins streams encoded by the same engine (so the player indices agree)."""
+        return cls(*(np.concatenate([getattr(stream, field) for stream in streams])
+                     for field in ('winners', 'losers', 'surfaces', 'days', 'ranks')))
+
+
+def match_keys(matches: pd.DataFrame) -> List[tuple]:
+    """(winner, loser, tournament, round) per row; frames without the last two fall back to the pair."""
+    columns = [column for column in MATCH_KEY_COLUMNS if column in matches.columns]
+    return list(zip(*(matches[column].astype('Int64').fillna(-1).tolist() for column in columns)))
+
+
+def first_match_ranks(winners: np.ndarray, losers: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+    """For every entry of concat([winners, losers]), the rank of that player's earliest match."""
+    players = np.column_stack([winners, losers]).ravel()
+    unique, first = np.unique(players, return_index=True)
+    first_ranks = np.repeat(ranks, 2)[first]
+    return first_ranks[np.searchsorted(unique, np.concatenate([winners, losers]))]
+
+
+def blend_probability(overall_probs: np.ndarray, surface_probs: np.ndarray, blend: float) -> np.ndarray:
+    """Mixes the two rating differences behind the probabilities; overall alone where surface is NaN."""
+    overall_probs = np.clip(overall_probs, 1e-12, 1 - 1e-12)
+    surface_probs = np.clip(surface_probs, 1e-12, 1 - 1e-12)
+    difference = np.log(overall_probs / (1 - overall_probs))
+    surface_difference = np.log(surface_probs / (1 - surface_probs))
+    difference = np.where(np.isnan(surface_difference), difference,
+                          blend * difference + (1 - blend) * surface_difference)
+    return 1 / (1 + np.exp(-difference))
+
+
+def surface_codes(surfaces) -> np.ndarray:
+    """Surface names (or a surface Categorical) to ID_C_T codes, 0 for anything unknown."""
+    categorical = pd.Categorical(surfaces)
+    # one lookup per category instead of per row; the extra trailing 0 catches code -1 (missing)
+    lookup = np.array([SURFACE_CODES.get(category, 0) for category in categorical.categories] + [0], dtype=np.int8)
+    return lookup[categorical.codes]
+
+
+class Watermark:
+    """
+    Incremental-update bookkeeping shared by EloEngine and featureStore.FeatureStore: the
+    last day applied (last_day) and the keys of the matches applied on that day
+    (last_day_keys), so a pull that starts on the watermark day skips what it has seen.
+    Subclasses set both in __init__ (None and an empty set).
+    """
+
+    def new_matches(self, matches: pd.DataFrame) -> pd.DataFrame:
+        """Drops rows at or before the watermark that were already applied."""
+        if self.last_day is None or matches.empty:
+            return matches
+        days = to_days(matches['DATE_G'])
+        keep = days > self.last_day
+        on_last_day = days == self.last_day
+        if on_last_day.any():
+            keys = match_keys(matches[on_last_day])
+            keep[np.flatnonzero(on_last_day)] = [key not in self.last_day_keys for key in keys]
+        return matches[keep]
+
+    def advance_watermark(self, matches: pd.DataFrame, days: np.ndarray):
+        if not len(days):
+            return
+        latest = int(days.max())
+        if self.last_day is None or latest > self.last_day:
+            self.last_day = latest
+            self.last_day_keys = set()
+        if latest == self.last_day:
+            self.last_day_keys.update(match_keys(matches[days == latest]))
+
+    @property
+    def last_date(self) -> Optional[pd.Timestamp]:
+        return None if self.last_day is None else pd.Timestamp(self.last_day, unit='D')
+
+
+class EloEngine(Watermark):
+    def __init__(self, k_factor: float = 32, initial_elo: float = 1500.0, start_low: Optional[float] = None,
+                 start_lowest: Optional[float] = None, blend: float = 1.0):
+        self.k_factor = k_factor
+        self.initial_elo = initial_elo
+        self.start_low = initial_elo if start_low is None else start_low
+        self.start_lowest = initial_elo if start_lowest is None else start_lowest
+        self.blend = blend
+        self.player_ids: List[int] = []
+        self.names: List[str] = []
+        self.index: Dict[int, int] = {}
+        self.id_lookup: Optional[pd.Index] = None
+        self.ratings = np.empty((0, len(RATING_COLUMNS)))
+        self.history_store = RatingHistory()
+        # set by modelStore.load_model so the history is only read from disk when first used
+        self.history_loader = None
+        self.history_index: Optional[HistoryIndex] = None
+        # watermark: last day applied and the keys of the matches applied on that day
+        self.last_day: Optional[int] = None
+        self.last_day_keys: Set[tuple] = set()
+
+    @property
+    def history(self) -> RatingHistory:
+        if self.history_loader is not None:
+            self.history_store = self.history_loader()
+            self.history_loader = None
+        return self.history_store
+
+    @property
+    def n_players(self) -> int:
+        return len(self.player_ids)
+
+    def start_ratings(self, ranks) -> np.ndarray:
+        """Starting rating for players whose first tournament had these RANK_T values (-1 unknown)."""
+        ranks = np.asarray(ranks)
+        return np.where(np.isin(ranks, [0, 1]), self.start_low,
+                        np.where(ranks == 6, self.start_lowest, self.initial_elo)).astype(float)
+
+    def add_players(self, player_ids, names, ranks=None) -> np.ndarray:
+        """
+        Registers unseen ids at their starting rating and returns the dense index of every input
+        id. ranks, aligned with player_ids, is the RANK_T of each player's first tournament.
+        """
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        _, first_seen = np.unique(player_ids, return_index=True)
+        added = []
+        for position in np.sort(first_seen):
+            player_id = int(player_ids[position])
+            if player_id not in self.index:
+                self.index[player_id] = len(self.player_ids)
+                self.player_ids.append(player_id)
+                self.names.append(names[position])
+                added.append(position)
+
+        if added:
+            starts = self.start_ratings(-1 if ranks is None else np.asarray(ranks)[added])
+            starts = np.broadcast_to(starts, (len(added),))[:, None]
+            self.ratings = np.vstack([self.ratings, np.repeat(starts, len(RATING_COLUMNS), axis=1)])
+        return pd.Index(self.player_ids).get_indexer(player_ids).astype(np.int32)
+
+    @timed()
+    def encode(self, matches: pd.DataFrame) -> MatchStream:
+        """Turns a get_matches_in_daterange frame (already in date order) into a MatchStream."""
+        winner_ids = matches['ID1_G'].to_numpy(dtype=np.int64)
+        loser_ids = matches['ID2_G'].to_numpy(dtype=np.int64)
+        ids = np.concatenate([winner_ids, loser_ids])
+        names = np.concatenate([matches['player1_name'].to_numpy(dtype=object),
+                                matches['player2_name'].to_numpy(dtype=object)])
+        ranks = (matches['tournament_rank'].astype('Int64').fillna(-1).to_numpy(dtype=np.int8)
+                 if 'tournament_rank' in matches.columns else np.full(len(matches), -1, dtype=np.int8))
+        indices = self.add_players(ids, names, first_match_ranks(winner_ids, loser_ids, ranks))
+        return MatchStream(
+            winners=indices[:len(matches)],
+            losers=indices[len(matches):],
+            surfaces=surface_codes(matches['surface']),
+            days=to_days(matches['DATE_G']),
+            ranks=ranks,
+        )
+
+    @timed()
+    def process(self, stream: MatchStream, record_history: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Applies every match in order and returns the winners' pre-match expected scores
+        (overall, surface). The loop works on a flat Python list copy of the ratings, which
+        is much cheaper to index than the array, and writes it back at the end.
+        """
+        n = len(stream)
+        k = self.k_factor
+        width = len(RATING_COLUMNS)
+        ratings = self.ratings.ravel().tolist()
+        overall_probs = [0.0] * n
+        surface_probs = [float('nan')] * n
+
+        # collected as lists inside the loop and appended to the columnar history in one go
+        history_player, history_day, history_surface, history_rating = [], [], [], []
+
+        for i, (w, l, s, day) in enumerate(zip(stream.winners.tolist(), stream.losers.tolist(),
+                                               stream.surfaces.tolist(), stream.days.tolist())):
+            wo, lo = w * width, l * width
+            winner_elo, loser_elo = ratings[wo], ratings[lo]
+            expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+            expected_loser = 1 / (1 + 10 ** ((winner_elo - loser_elo) / 400))
+            ratings[wo] = winner_elo + k * (1 - expected_winner)
+            ratings[lo] = loser_elo + k * (0 - expected_loser)
+            overall_probs[i] = expected_winner
+
+            if record_history:
+                history_player += (w, l)
+                history_day += (day, day)
+                history_surface += (0, 0)
+                history_rating += (ratings[wo], ratings[lo])
+
+            if s:
+                ws, ls = wo + s, lo + s
+                winner_elo, loser_elo = ratings[ws], ratings[ls]
+                expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+                expected_loser = 1 / (1 + 10 ** ((winner_elo - loser_elo) / 400))
+                ratings[ws] = winner_elo + k * (1 - expected_winner)
+                ratings[ls] = loser_elo + k * (0 - expected_loser)
+                surface_probs[i] = expected_winner
+
+                if record_history:
+                    history_player += (w, l)
+                    history_day += (day, day)
+                    history_surface += (s, s)
+                    history_rating += (ratings[ws], ratings[ls])
+
+        self.ratings = np.array(ratings).reshape(-1, width)
+        if record_history:
+            self.history.extend(history_player, history_day, history_surface, history_rating)
+        return np.array(overall_probs), np.array(surface_probs)
+
+    @timed()
+    def fit(self, matches: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Applies the matches not yet seen by this model, so overlapping pulls (e.g. an update
+        starting on the watermark day) never count a match twice.
+        """
+        matches = self.new_matches(matches)
+        stream = self.encode(matches)
+        probs = self.process(stream)
+        self.advance_watermark(matches, stream.days)
+        return probs
+
+    def get_elo(self, player_id: int, surface: str = 'overall') -> Optional[float]:
+        """Current rating, falling back to overall for unknown surfaces; None for unknown players."""
+        row = self.index.get(int(player_id))
+        if row is None:
+            return None
+        column = SURFACE_CODES.get(surface, 0)
+        return float(self.ratings[row, column])
+
+    def rows_for(self, player_ids) -> np.ndarray:
+        """Dense index of every id, -1 for players the model has not seen (or missing ids)."""
+        ids = np.asarray(player_ids)
+        if ids.dtype.kind not in 'iu':
+            ids = pd.Series(player_ids).astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+        # players are only ever appended, so the hashed lookup is stale exactly when the count changed
+        if self.id_lookup is None or len(self.id_lookup) != self.n_players:
+            self.id_lookup = pd.Index(self.player_ids, dtype=np.int64)
+        return self.id_lookup.get_indexer(ids)
+
+    @timed()
+    def predict_many(self, id1s, id2s, surfaces=None, fallback: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Player 1's win probability for every (id1, id2, surface) row, as arrays under 'overall',
+        'surface' and 'blend'. Unknown players are rated at fallback (initial_elo by default);
+        unknown or missing surfaces use the overall ratings, like get_elo.
+        """
+        fallback = self.initial_elo if fallback is None else fallback
+        rows1, rows2 = self.rows_for(id1s), self.rows_for(id2s)
+        known1, known2 = rows1 >= 0, rows2 >= 0
+        ratings = np.asarray(self.ratings)
+        if not len(ratings):
+            ratings = np.full((1, len(RATING_COLUMNS)), fallback)
+        rows1, rows2 = np.where(known1, rows1, 0), np.where(known2, rows2, 0)
+
+        codes = np.zeros(len(rows1), dtype=np.int8) if surfaces is None else surface_codes(surfaces)
+        # gather from the flattened array: row * width + column is one 1-D take per side
+        flat, width = ratings.ravel(), ratings.shape[1]
+        offsets1, offsets2 = rows1 * width, rows2 * width
+        probs = {}
+        for name, columns in (('overall', 0), ('surface', codes)):
+            elo1 = np.where(known1, flat.take(offsets1 + columns), fallback)
+            elo2 = np.where(known2, flat.take(offsets2 + columns), fallback)
+            probs[name] = 1 / (1 + np.exp((elo2 - elo1) * (np.log(10) / 400)))
+        probs['blend'] = (probs['overall'] if self.blend == 1
+                          else blend_probability(probs['overall'], probs['surface'], self.blend))
+        return probs
+
+    def get_history(self, player_id: int, surface: str = 'overall') -> pd.Series:
+        """Rating after each match day of a player, indexed by date."""
+        row = self.index.get(int(player_id), -1)
+        days, ratings = self.history.series(row, SURFACE_CODES.get(surface, 0))
+        return pd.Series(ratings, index=pd.to_datetime(days, unit='D'), dtype=float)
+
+    def as_of_index(self) -> HistoryIndex:
+        # history is append-only, so the sorted index is stale exactly when the row count changed
+        if self.history_index is None or self.history_index.size != len(self.history):
+            self.history_index = HistoryIndex(self.history)
+        return self.history_index
+
+    @timed()
+    def ratings_as_of(self, player_ids, dates, surfaces=None, strict: bool = True,
+                      fallback: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Each player's rating as of each date, as arrays under 'overall' and 'surface'. By
+        default that is before the date, i.e. the pre-match rating of a match played on it.
+        Players with no rating yet get fallback (initial_elo by default); unknown or missing
+        surfaces use the overall rating, like get_elo.
+        """
+        fallback = self.initial_elo if fallback is None else fallback
+        rows, days = self.rows_for(player_ids), to_days(dates)
+        index = self.as_of_index()
+        codes = 0 if surfaces is None else surface_codes(surfaces)
+        return {
+            'overall': np.nan_to_num(index.lookup(rows, days, 0, strict), nan=fallback),
+            'surface': np.nan_to_num(index.lookup(rows, days, codes, strict), nan=fallback),
+        }
+
+    def ratings_on(self, date, surface: str = 'overall') -> pd.DataFrame:
+        """Every player's rating as of date (inclusive)."""
+        rows, ratings = self.history.on_date(int(to_days([date])[0]), SURFACE_CODES.get(surface, 0))
+        return self.rating_frame(rows, ratings)
+
+    def top_n(self, date, n: int = 10, surface: str = 'overall') -> pd.DataFrame:
+        rows, ratings = self.history.top_n(int(to_days([date])[0]), n, SURFACE_CODES.get(surface, 0))
+        return self.rating_frame(rows, ratings)
+
+    def rating_frame(self, rows: np.ndarray, ratings: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({
+            'id': np.asarray(self.player_ids, dtype=np.int64)[rows],
+            'name': np.asarray(self.names, dtype=object)[rows],
+            'elo': ratings,
+        })
+
+    def summary(self) -> pd.DataFrame:
+        frame = pd.DataFrame(self.ratings, columns=RATING_COLUMNS)
+        frame.insert(0, 'name', self.names)
+        frame.insert(0, 'id', self.player_ids)
+        return frame
+
+
+def attach_elo(matches: pd.DataFrame, model: EloEngine, id_columns: Sequence[str] = ('ID1_G', 'ID2_G'),
+               date_column: str = 'DATE_G', surface_column: str = 'surface',
+               prefixes: Sequence[str] = ('player1', 'player2'), strict: bool = True) -> pd.DataFrame:
+    """
+    Adds <prefix>_elo and <prefix>_surface_elo columns holding each player's rating before the
+    match date, the Elo counterpart of features.attach_rankings.
+    """
+    surfaces = matches[surface_column].to_numpy() if surface_column in matches else None
+    for id_column, prefix in zip(id_columns, prefixes):
+        ratings = model.ratings_as_of(matches[id_column].to_numpy(), matches[date_column].to_numpy(), surfaces, strict)
+        matches[f'{prefix}_elo'] = ratings['overall']
+        matches[f'{prefix}_surface_elo'] = ratings['surface']
+    return matches
@@ -0,0 +1,175 @@
+"""
+Parallel hyperparameter sweep for the Elo model.
+
+The match stream is pulled from the DB once, encoded to arrays and written to a temporary
+directory as .npy files. Each worker process memory-maps those files once in its
+initializer and then replays the stream for every configuration it is handed. Only
+the config and its scores cross process boundaries.
+
+A configuration is a set of EloEngine parameters, so the winner can be fitted with
+naiveElo as it is:
+
+    k_factor                   K used for both overall and surface updates
+    start_low/start_lowest     starting rating by the RANK_T of a player's first tournament
+                               (rank 0/1 -> low, rank 6 -> lowest, else 1500)
+    blend                      weight of the overall rating difference in the price; the
+                               rest goes to the surface rating
+
+Each config is scored on the winners' blended pre-match probabilities (the app's Model
+column) by log-loss and Brier score, skipping the first burn_in share of matches while
+ratings settle.
+
+    python eloSweep.py --tour atp --start 2010-01-01
+    python eloSweep.py --tour wta --random 200 --workers 8
+"""
+import argparse
+import functools
+import itertools
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from accessDB import iter_matches_in_daterange
+from eloEngine import EloEngine, MatchStream, RATING_COLUMNS, blend_probability, first_match_ranks
+
+STREAM_FIELDS = ('winners', 'losers', 'surfaces', 'days', 'ranks')
+# what naiveElo fits by default: K=32, everyone starts at 1500, priced on the overall rating
+DEFAULT_CONFIG = {'k_factor': 32.0, 'start_low': 1500.0, 'start_lowest': 1500.0, 'blend': 1.0}
+
+
+def load_match_stream(tour: str, start_date: datetime, end_date: datetime = None,
+                      chunk_size: int = 50_000) -> Tuple[MatchStream, int]:
+    """Encodes every match in the range with one shared player index; returns (stream, n_players)."""
+    encoder = EloEngine()
+    streams = [encoder.encode(matches)
+               for matches in iter_matches_in_daterange(tour, start_date, end_date, chunk_size=chunk_size)]
+    if not streams:
+        raise ValueError(f"No {tour} matches found from {start_date}")
+    return MatchStream.concat(streams), encoder.n_players
+
+
+def score(winner_probs: np.ndarray, burn_in: float = 0.1) -> Dict[str, float]:
+    probs = np.clip(winner_probs[int(len(winner_probs) * burn_in):], 1e-12, 1 - 1e-12)
+    return {
+        'log_loss': float(-np.mean(np.log(probs))),
+        'brier': float(np.mean((1 - probs) ** 2)),
+        'accuracy': float(np.mean(probs > 0.5)),
+        'matches_scored': int(len(probs)),
+    }
+
+
+def initial_ratings(engine: EloEngine, stream: MatchStream, n_players: int) -> np.ndarray:
+    """Every player's starting rating from the rank of their first match, as EloEngine.encode seeds them."""
+    start = np.full(n_players, engine.initial_elo)
+    start[np.concatenate([stream.winners, stream.losers])] = engine.start_ratings(
+        first_match_ranks(stream.winners, stream.losers, stream.ranks))
+    return start
+
+
+def replay(stream: MatchStream, n_players: int, config: Dict[str, float]) -> np.ndarray:
+    """Fits a fresh model with config over stream and returns the blended pre-match probabilities."""
+    engine = EloEngine(**config)
+    engine.ratings = np.repeat(initial_ratings(engine, stream, n_players)[:, None], len(RATING_COLUMNS), axis=1)
+    overall_probs, surface_probs = engine.process(stream, record_history=False)
+    return blend_probability(overall_probs, surface_probs, engine.blend)
+
+
+# set once per worker process by init_worker
+worker_stream = None
+worker_players = 0
+
+
+def init_worker(directory: str, n_players: int):
+    global worker_stream, worker_players
+    worker_stream = MatchStream(*(np.load(os.path.join(directory, f'{field}.npy'), mmap_mode='r')
+                                  for field in STREAM_FIELDS))
+    worker_players = n_players
+
+
+def evaluate(config: Dict[str, float], burn_in: float) -> Dict[str, float]:
+    return {**config, **score(replay(worker_stream, worker_players, config), burn_in)}
+
+
+def grid_configs(k_factors=(16, 24, 32, 40, 48), start_ratings=((1420, 1340), (1500, 1500)),
+                 blends=(1.0, 0.75, 0.5, 0.25)) -> List[Dict[str, float]]:
+    return [
+        {'k_factor': float(k), 'start_low': float(low), 'start_lowest': float(lowest), 'blend': float(blend)}
+        for k, (low, lowest), blend in itertools.product(k_factors, start_ratings, blends)
+    ]
+
+
+def random_configs(n: int, seed: int = 0, k_range=(8, 64), low_drop=(0, 150), lowest_drop=(0, 250),
+                   blend_range=(0, 1)) -> List[Dict[str, float]]:
+    """Random search; the low/lowest starts are drawn as drops below the 1500 default."""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        low = 1500 - rng.uniform(*low_drop)
+        configs.append({
+            'k_factor': rng.uniform(*k_range),
+            'start_low': low,
+            'start_lowest': low - rng.uniform(*lowest_drop),
+            'blend': rng.uniform(*blend_range),
+        })
+    return configs
+
+
+def unique_configs(configs: List[Dict[str, float]]) -> List[Dict[str, float]]:
+    """Drops repeated configs, keeping the first of each."""
+    seen = {}
+    for config in configs:
+        seen.setdefault(tuple(sorted(config.items())), config)
+    return list(seen.values())
+
+
+def run_sweep(stream: MatchStream, n_players: int, configs: List[Dict[str, float]],
+              workers: int = None, burn_in: float = 0.1) -> pd.DataFrame:
+    """Scores every config across worker processes and returns the results, best log-loss first."""
+    directory = tempfile.mkdtemp(prefix='elo_sweep_')
+    try:
+        for field in STREAM_FIELDS:
+            np.save(os.path.join(directory, f'{field}.npy'), getattr(stream, field))
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker,
+                                 initargs=(directory, n_players)) as pool:
+            results = list(pool.map(functools.partial(evaluate, burn_in=burn_in), configs))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return pd.DataFrame(results).sort_values('log_loss', ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid or random search over Elo parameters")
+    parser.add_argument('--tour', choices=['atp', 'wta'], default='wta')
+    parser.add_argument('--start', default='2015-01-01')
+    parser.add_argument('--end', default=None, help="defaults to yesterday")
+    parser.add_argument('--random', type=int, default=0, help="number of random configs instead of the grid")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--burn-in', type=float, default=0.1)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', default=None, help="optional CSV with every result")
+    args = parser.parse_args()
+
+    stream, n_players = load_match_stream(
+        args.tour,
+        datetime.strptime(args.start, '%Y-%m-%d'),
+        datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    )
+    configs = random_configs(args.random, args.seed) if args.random else grid_configs()
+    configs = unique_configs(configs + [dict(DEFAULT_CONFIG)])
+    results = run_sweep(stream, n_players, configs, args.workers, args.burn_in)
+
+    print(f"{len(stream)} matches, {n_players} players, {len(configs)} configs")
+    print(results.head(args.top).to_string(index=False))
+    best = results.iloc[0]
+    print(f"Deploy the best with: python naiveElo.py fit --tour {args.tour} --k-factor {best['k_factor']:g} "
+          f"--start-low {best['start_low']:g} --start-lowest {best['start_lowest']:g} --blend {best['blend']:g}")
+    if args.output:
+        results.to_csv(args.output, index=False)
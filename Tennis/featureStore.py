@@ -0,0 +1,331 @@
+"""
+Rolling per-player serve and return form from stat_*, maintained incrementally.
+
+Each player has a deque of (day, counts) entries, one per match, and a running sum of
+the counts. A new match appends one entry and adds it to the sum. An entry drops out of
+the window by popping the left of the deque and subtracting it. Both are O(1), so
+keeping the store current costs only the new matches. A lookup just divides sums.
+
+Counts per match, from the player's side of the stat_* row:
+
+    first_in / serve_points         FS / FSOF
+    first_won / first_points        W1S / W1SOF
+    second_won / second_points      W2S / W2SOF
+    aces, double_faults             ACES, DF
+    return_won / return_points      RPW / RPWOF
+    bp_saved / bp_faced             opponent's BPOF - BP / opponent's BPOF
+
+The store is saved as one .npz of flat arrays. update() pulls only matches after its
+watermark, using the same eloEngine.Watermark rules as EloEngine. OnCourt often adds the
+stat_* row some time after the result, so a match that had none is kept as pending for
+late_days and pulled again on later updates until its stats arrive (the mirror's
+overlap_days exists for the same reason).
+
+The app only reads the saved file (ONCOURT_FEATURE_STORE_DIR, default the working
+directory) and picks up a new one when it changes. Run update next to the nightly
+naiveElo update.
+
+    python featureStore.py --tour atp update
+    python featureStore.py --tour wta show --player "Iga Swiatek"
+"""
+import argparse
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from accessDB import iter_matches_in_daterange, get_match_stats_bulk
+from eloEngine import MATCH_KEY_COLUMNS, Watermark, match_keys
+from features import to_days
+from markovPricer import PRIOR_POINTS, rates_from_totals
+from playerDirectory import get_directory
+from timings import timed
+
+COUNTERS = ['first_in', 'serve_points', 'first_won', 'first_points', 'second_won', 'second_points',
+            'aces', 'double_faults', 'return_won', 'return_points', 'bp_saved', 'bp_faced']
+FORMAT_VERSION = 1
+
+
+def side_counts(stats: pd.DataFrame, me: str, them: str) -> np.ndarray:
+    """(matches x COUNTERS) counts for the `me` side of oriented stat rows; NaN where missing."""
+    def column(name):
+        return pd.to_numeric(stats[name], errors='coerce').to_numpy(dtype=float)
+
+    return np.column_stack([
+        column(f'FS_{me}'), column(f'FSOF_{me}'),
+        column(f'W1S_{me}'), column(f'W1SOF_{me}'),
+        column(f'W2S_{me}'), column(f'W2SOF_{me}'),
+        column(f'ACES_{me}'), column(f'DF_{me}'),
+        column(f'RPW_{me}'), column(f'RPWOF_{me}'),
+        column(f'BPOF_{them}') - column(f'BP_{them}'), column(f'BPOF_{them}'),
+    ])
+
+
+class FeatureStore(Watermark):
+    def __init__(self, window_days: int = 364, late_days: int = 14):
+        self.window_days = window_days
+        self.late_days = late_days
+        self.entries: Dict[int, deque] = {}
+        self.sums: Dict[int, List[float]] = {}
+        # match key -> day, for matches already behind the watermark that had no stats yet
+        self.pending: Dict[tuple, int] = {}
+        # watermark: last day applied and the keys of the matches applied on that day
+        self.last_day: Optional[int] = None
+        self.last_day_keys: Set[tuple] = set()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+    def append(self, player: int, day: int, counts):
+        entries = self.entries.get(player)
+        if entries is None:
+            entries = self.entries[player] = deque()
+            self.sums[player] = [0.0] * len(COUNTERS)
+        if entries and entries[-1][0] > day:
+            # a pending match whose stats came late: keep the deque in day order
+            position = len(entries)
+            while position and entries[position - 1][0] > day:
+                position -= 1
+            entries.insert(position, (day, counts))
+        else:
+            entries.append((day, counts))
+        sums = self.sums[player]
+        for position, value in enumerate(counts):
+            sums[position] += value
+        self.expire(player, entries[-1][0])
+
+    def expire(self, player: int, day: int):
+        """Drops the player's entries that are window_days or more before day."""
+        entries, sums = self.entries[player], self.sums[player]
+        cutoff = day - self.window_days
+        while entries and entries[0][0] <= cutoff:
+            _, counts = entries.popleft()
+            for position, value in enumerate(counts):
+                sums[position] -= value
+
+    def wanted(self, matches: pd.DataFrame) -> np.ndarray:
+        """Rows not yet applied: past the watermark, or pending their stats."""
+        wanted = matches.index.isin(self.new_matches(matches).index)
+        if self.pending:
+            wanted |= np.array([key in self.pending for key in match_keys(matches)], dtype=bool)
+        return wanted
+
+    @timed()
+    def add_matches(self, matches: pd.DataFrame, stats: pd.DataFrame) -> int:
+        """
+        Applies date-ordered matches (get_matches_in_daterange rows) with their stats aligned
+        row for row, as get_match_stats_bulk returns them. A match without stats still moves
+        the watermark and is kept as pending until its stats turn up or it is more than
+        late_days behind the watermark. Returns how many matches were added.
+        """
+        matches = matches.reset_index(drop=True)
+        stats = stats.reset_index(drop=True)
+        new = matches.index.isin(self.new_matches(matches).index)
+        keep = self.wanted(matches)
+        matches, stats, new = matches[keep], stats[keep], new[keep]
+        days = to_days(matches['DATE_G'])
+        keys = match_keys(matches)
+
+        winners = matches['ID1_G'].astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+        losers = matches['ID2_G'].astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+        counts1, counts2 = side_counts(stats, '1', '2'), side_counts(stats, '2', '1')
+        players = (winners >= 0) & (losers >= 0)
+        complete = ~(np.isnan(counts1).any(axis=1) | np.isnan(counts2).any(axis=1)) & players
+
+        for winner, loser, day, winner_counts, loser_counts in zip(
+                winners[complete].tolist(), losers[complete].tolist(), days[complete].tolist(),
+                counts1[complete].tolist(), counts2[complete].tolist()):
+            self.append(winner, day, winner_counts)
+            self.append(loser, day, loser_counts)
+        for position in np.flatnonzero(players).tolist():
+            if complete[position]:
+                self.pending.pop(keys[position], None)
+            else:
+                self.pending[keys[position]] = int(days[position])
+
+        self.advance_watermark(matches[new], days[new])
+        if self.last_day is not None:
+            cutoff = self.last_day - self.late_days
+            self.pending = {key: day for key, day in self.pending.items() if day >= cutoff}
+        return int(complete.sum())
+
+    def update(self, tour: str, end_date: datetime = None, chunk_size: int = 50_000) -> int:
+        """
+        Pulls every match after the watermark (or the last window, for an empty store) from the
+        DB, starting early enough to retry the pending matches.
+        """
+        if self.last_day is None:
+            start_date = datetime.now() - timedelta(days=self.window_days)
+        else:
+            start_date = pd.Timestamp(min([self.last_day, *self.pending.values()]), unit='D').to_pydatetime()
+        added = 0
+        for matches in iter_matches_in_daterange(tour, start_date, end_date, chunk_size=chunk_size):
+            matches = matches[self.wanted(matches)]
+            if matches.empty:
+                continue
+            stats = get_match_stats_bulk(tour, matches)
+            if stats is None:
+                raise ValueError(f"Could not load {tour} stats")
+            added += self.add_matches(matches, stats)
+        return added
+
+    def totals(self, player_ids, date=None) -> pd.DataFrame:
+        """
+        COUNTERS summed over the window ending at date, one row per id. date defaults to the
+        watermark and should not be earlier than it: expired entries are gone for good.
+        """
+        day = self.last_day if date is None else int(to_days([date])[0])
+        ids = pd.Series(player_ids).astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+        rows = np.zeros((len(ids), len(COUNTERS)))
+        matches = np.zeros(len(ids), dtype=np.int64)
+        for position, player in enumerate(ids.tolist()):
+            if player not in self.entries:
+                continue
+            if day is not None:
+                self.expire(player, day)
+            rows[position] = self.sums[player]
+            matches[position] = len(self.entries[player])
+        frame = pd.DataFrame(rows, columns=COUNTERS, index=pd.Index(ids, name='player'))
+        frame.insert(0, 'matches', matches)
+        return frame
+
+    @timed()
+    def features(self, player_ids, date=None) -> pd.DataFrame:
+        """Rolling rates for every id, in input order; NaN where the player has no matches in the window."""
+        totals = self.totals(player_ids, date)
+
+        def ratio(won, of):
+            return (totals[won] / totals[of].where(totals[of] > 0)).to_numpy()
+
+        return pd.DataFrame({
+            'matches': totals['matches'].to_numpy(),
+            'first_serve_in': ratio('first_in', 'serve_points'),
+            'first_serve_won': ratio('first_won', 'first_points'),
+            'second_serve_won': ratio('second_won', 'second_points'),
+            'serve_points_won': ((totals['first_won'] + totals['second_won'])
+                                 / totals['serve_points'].where(totals['serve_points'] > 0)).to_numpy(),
+            'return_points_won': ratio('return_won', 'return_points'),
+            'bp_saved': ratio('bp_saved', 'bp_faced'),
+            'ace_rate': ratio('aces', 'serve_points'),
+            'double_fault_rate': ratio('double_faults', 'serve_points'),
+        }, index=totals.index)
+
+    def point_rates(self, date=None, prior_points: float = PRIOR_POINTS) -> Tuple[pd.DataFrame, float]:
+        """Every player's serve/return rates over the window, as markovPricer.rates_from_totals returns them."""
+        totals = self.totals(list(self.entries), date)
+        totals = totals[(totals['serve_points'] > 0) & (totals['return_points'] > 0)]
+        return rates_from_totals(pd.DataFrame({
+            'serve_won': totals['first_won'] + totals['second_won'],
+            'serve_points': totals['serve_points'],
+            'return_won': totals['return_won'],
+            'return_points': totals['return_points'],
+        }), prior_points)
+
+    def save(self, path: str):
+        """Writes the store as flat arrays to path (.npz), replacing any previous file in one rename."""
+        players, days, counts = [], [], []
+        for player, entries in self.entries.items():
+            for day, values in entries:
+                players.append(player)
+                days.append(day)
+                counts.append(values)
+        staging = path + '.tmp.npz'
+        np.savez_compressed(
+            staging,
+            format_version=FORMAT_VERSION,
+            window_days=self.window_days,
+            late_days=self.late_days,
+            last_day=-1 if self.last_day is None else self.last_day,
+            last_day_keys=np.array(sorted(self.last_day_keys), dtype=np.int64).reshape(len(self.last_day_keys), -1)
+            if self.last_day_keys else np.empty((0, len(MATCH_KEY_COLUMNS)), dtype=np.int64),
+            players=np.array(players, dtype=np.int64),
+            days=np.array(days, dtype=np.int64),
+            counts=np.array(counts, dtype=np.float64).reshape(len(counts), len(COUNTERS)),
+            pending_keys=np.array(list(self.pending), dtype=np.int64).reshape(len(self.pending), -1)
+            if self.pending else np.empty((0, len(MATCH_KEY_COLUMNS)), dtype=np.int64),
+            pending_days=np.array(list(self.pending.values()), dtype=np.int64),
+        )
+        os.replace(staging, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FeatureStore':
+        with np.load(path) as data:
+            if int(data['format_version']) != FORMAT_VERSION:
+                raise ValueError(f"{path} has feature store format {int(data['format_version'])}, expected {FORMAT_VERSION}")
+            store = cls(window_days=int(data['window_days']),
+                        late_days=int(data['late_days']) if 'late_days' in data else 14)
+            last_day = int(data['last_day'])
+            store.last_day = None if last_day < 0 else last_day
+            store.last_day_keys = {tuple(key) for key in data['last_day_keys'].tolist()}
+            if 'pending_keys' in data:
+                store.pending = dict(zip(map(tuple, data['pending_keys'].tolist()), data['pending_days'].tolist()))
+            players, days, counts = data['players'], data['days'], data['counts']
+
+        # entries were saved player by player in day order, so appending in file order rebuilds the deques
+        for player, day, values in zip(players.tolist(), days.tolist(), counts.tolist()):
+            entries = store.entries.get(player)
+            if entries is None:
+                entries = store.entries[player] = deque()
+                store.sums[player] = [0.0] * len(COUNTERS)
+            entries.append((day, values))
+            sums = store.sums[player]
+            for position, value in enumerate(values):
+                sums[position] += value
+        return store
+
+
+# tour -> (file mtime, store) of the saved stores read by get_feature_store
+feature_stores: Dict[str, Tuple[int, FeatureStore]] = {}
+
+
+def store_path(tour: str) -> str:
+    return os.path.join(os.environ.get('ONCOURT_FEATURE_STORE_DIR', '.'), f'feature_store_{tour}.npz')
+
+
+def update_store(tour: str, end_date: datetime = None) -> Tuple[FeatureStore, int]:
+    """Loads the saved store (or starts an empty one), pulls the matches since its watermark and saves it back."""
+    path = store_path(tour)
+    store = FeatureStore.load(path) if os.path.exists(path) else FeatureStore()
+    added = store.update(tour, end_date)
+    store.save(path)
+    return store, added
+
+
+def get_feature_store(tour: str) -> FeatureStore:
+    """
+    The saved store for a tour, read again whenever the file changes. Never touches the DB:
+    the store is kept current offline with `python featureStore.py update`.
+    """
+    path = store_path(tour)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise ValueError(f"No feature store at {path}, run featureStore.py --tour {tour} update")
+    cached = feature_stores.get(tour)
+    if cached is None or cached[0] != mtime:
+        feature_stores[tour] = (mtime, FeatureStore.load(path))
+    return feature_stores[tour][1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, update or inspect the rolling player feature store")
+    parser.add_argument('command', nargs='?', choices=['update', 'show'], default='update')
+    parser.add_argument('--tour', choices=['atp', 'wta'], default='wta')
+    parser.add_argument('--player', action='append', help="names to show, defaults to the 20 busiest players")
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        store, added = update_store(args.tour)
+        print(f"Added {added} matches")
+    else:
+        store = get_feature_store(args.tour)
+    print(f"{len(store)} matches in the window up to {store.last_date}")
+    if args.command == 'show':
+        if args.player:
+            player_ids = get_directory(args.tour).resolve_many(args.player)
+        else:
+            player_ids = sorted(store.entries, key=lambda player: -len(store.entries[player]))[:20]
+        print(store.features(player_ids).round(3).to_string())
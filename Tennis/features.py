@@ -0,0 +1,95 @@
+"""
+Match-level features built from the OnCourt tables without per-row queries.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+from accessDB import get_rankings
+
+# (player, day) pairs are packed into one int64 so a single searchsorted does the as-of lookup.
+# Days are offset so anything from ~1400 to ~2500 stays positive in the low DAY_BITS bits.
+DAY_BITS = 20
+DAY_OFFSET = 1 << 19
+
+
+def to_days(dates) -> np.ndarray:
+    """Days since 1970-01-01 as int64; NaT becomes -DAY_OFFSET so it never matches."""
+    days = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[D]').astype(np.int64)
+    days[pd.isna(pd.Series(dates)).to_numpy()] = -DAY_OFFSET
+    return days
+
+
+def pack_keys(players: np.ndarray, days: np.ndarray) -> np.ndarray:
+    return (players.astype(np.int64) << DAY_BITS) | (days + DAY_OFFSET)
+
+
+class RankingIndex:
+    """
+    Weekly ranking snapshots sorted by (player, date), answering "rank and points of
+    player p as of day d" for whole arrays of (p, d) with one binary search each.
+    """
+    def __init__(self, rankings: pd.DataFrame):
+        rankings = rankings.dropna(subset=['DATE_R', 'ID_P_R'])
+        players = rankings['ID_P_R'].to_numpy(dtype=np.int64)
+        days = to_days(rankings['DATE_R'])
+        order = np.lexsort((days, players))
+
+        self.players = players[order]
+        self.keys = pack_keys(self.players, days[order])
+        self.points = rankings['POINT_R'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        self.positions = rankings['POS_R'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+
+    @classmethod
+    def from_db(cls, tour: str, start_date=None) -> 'RankingIndex':
+        rankings = get_rankings(tour, start_date)
+        if rankings is None:
+            raise ValueError(f"Could not load rankings for {tour}")
+        return cls(rankings)
+
+    def lookup(self, player_ids, dates, strict: bool = False):
+        """
+        Returns (positions, points) arrays aligned to the inputs, NaN where the player had no
+        ranking yet. With strict=True a snapshot dated on the same day is not used.
+        """
+        player_ids = pd.Series(player_ids)
+        missing = player_ids.isna().to_numpy()
+        players = player_ids.fillna(-1).to_numpy(dtype=np.int64)
+        days = to_days(dates)
+        if not len(self.keys):
+            empty = np.full(len(players), np.nan)
+            return empty, empty.copy()
+
+        rows = np.searchsorted(self.keys, pack_keys(players, days), side='left' if strict else 'right') - 1
+        found = (rows >= 0) & ~missing & (days > -DAY_OFFSET)
+        rows = np.where(found, rows, 0)
+        found &= self.players[rows] == players
+
+        positions = np.where(found, self.positions[rows], np.nan)
+        points = np.where(found, self.points[rows], np.nan)
+        return positions, points
+
+
+ranking_indexes: Dict[str, RankingIndex] = {}
+
+
+def get_ranking_index(tour: str) -> RankingIndex:
+    """Returns the ranking index for a tour, loading ratings_* on first use."""
+    if tour not in ranking_indexes:
+        ranking_indexes[tour] = RankingIndex.from_db(tour)
+    return ranking_indexes[tour]
+
+
+def attach_rankings(matches: pd.DataFrame, index: RankingIndex,
+                    id_columns: Sequence[str] = ('ID1_G', 'ID2_G'), date_column: str = 'DATE_G',
+                    prefixes: Sequence[str] = ('player1', 'player2'), strict: bool = False) -> pd.DataFrame:
+    """
+    Adds <prefix>_rank and <prefix>_points columns holding each player's ranking as of the
+    match date, e.g. to a frame from get_matches_in_daterange.
+    """
+    for id_column, prefix in zip(id_columns, prefixes):
+        positions, points = index.lookup(matches[id_column].to_numpy(), matches[date_column].to_numpy(), strict)
+        matches[f'{prefix}_rank'] = pd.array(positions, dtype='Float64').astype('Int32')
+        matches[f'{prefix}_points'] = pd.array(points, dtype='Float64').astype('Int32')
+    return matches
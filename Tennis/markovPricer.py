@@ -0,0 +1,223 @@
+"""
+Point-level Markov pricing from serve and return point-win rates.
+
+With pa and pb the chances that A and B win a point on their own serve, the usual
+independent-points model gives:
+
+    game        closed form for the server's hold probability
+    tiebreak    recursion to 6-6, then the two-points-in-a-row deuce formula
+    set         recursion over games to 6 with a tiebreak at 6-6, tracking whether the
+                number of games is odd so the next set's first server is known
+    match       recursion over sets for best of 3 or 5, averaged over who serves first
+
+Every recursion is written over NumPy arrays, so a whole (pa, pb) grid is solved in one
+pass. The set and match results are cached per format as grids, and a batch of matchups
+is priced by bilinear interpolation, never by recursion per matchup.
+
+Point rates come from the rolling stat_* sums in featureStore: serve = (W1S + W2S) / FSOF
+and return = RPW / RPWOF. They are combined for a matchup as in Barnett and Clarke (2005):
+
+    pa = tour_serve + (serve_A - tour_serve) - (return_B - tour_return)
+"""
+import functools
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from timings import timed
+
+GRID_LOW, GRID_HIGH, GRID_STEP = 0.2, 0.95, 0.005
+# points of tour-average play mixed into every player's rates, so small samples stay near the average
+PRIOR_POINTS = 100
+# tours_*.RANK_T of the Grand Slams, the only best-of-5 events on the men's tour
+GRAND_SLAM_RANK = 4
+
+
+def hold_probability(p):
+    """Chance the server wins a game when winning each point with probability p."""
+    p = np.asarray(p, dtype=float)
+    q = 1 - p
+    return p ** 4 * (1 + 4 * q + 10 * q ** 2) + 20 * (p * q) ** 3 * p ** 2 / (1 - 2 * p * q)
+
+
+def tiebreak_probability(pa, pb, target: int = 7):
+    """Chance A wins a tiebreak to `target` in which A serves the first point."""
+    pa, pb = np.asarray(pa, dtype=float), np.asarray(pb, dtype=float)
+    reach = {(0, 0): np.ones(np.broadcast(pa, pb).shape)}
+    won = 0.0
+    for points in range(2 * (target - 1)):
+        # A serves point 0, then each player serves two in turn
+        a_serves = points == 0 or (points - 1) // 2 % 2 == 1
+        point = pa if a_serves else 1 - pb
+        for a in range(points + 1):
+            probability = reach.pop((a, points - a), None)
+            if probability is None:
+                continue
+            b = points - a
+            if a + 1 == target and b < target - 1:
+                won = won + probability * point
+            else:
+                reach[(a + 1, b)] = reach.get((a + 1, b), 0.0) + probability * point
+            if b + 1 < target:
+                reach[(a, b + 1)] = reach.get((a, b + 1), 0.0) + probability * (1 - point)
+
+    # from target-1 all, each pair of points has one serve each; two in a row wins
+    deuce = reach.get((target - 1, target - 1), 0.0)
+    win_pair, lose_pair = pa * (1 - pb), (1 - pa) * pb
+    return won + deuce * win_pair / (win_pair + lose_pair)
+
+
+def set_outcomes(hold_first, hold_second, tiebreak_first) -> Tuple[np.ndarray, ...]:
+    """
+    Outcome split of a set in which the first player serves the first game:
+    (first wins in an even number of games, first wins odd, second wins even, second wins odd).
+    After an even number of games the same player serves first in the next set.
+    """
+    reach = {(0, 0): np.ones(np.broadcast(hold_first, hold_second).shape)}
+    first_even = first_odd = second_even = second_odd = 0.0
+    for games in range(12):
+        game = hold_first if games % 2 == 0 else 1 - hold_second
+        for a in range(games + 1):
+            probability = reach.pop((a, games - a), None)
+            if probability is None:
+                continue
+            for winner_a, share in ((True, game), (False, 1 - game)):
+                state = (a + 1, games - a) if winner_a else (a, games - a + 1)
+                total = games + 1
+                if state[0] == 6 and state[1] <= 4 or state == (7, 5):
+                    if total % 2:
+                        first_odd = first_odd + probability * share
+                    else:
+                        first_even = first_even + probability * share
+                elif state[1] == 6 and state[0] <= 4 or state == (5, 7):
+                    if total % 2:
+                        second_odd = second_odd + probability * share
+                    else:
+                        second_even = second_even + probability * share
+                else:
+                    reach[state] = reach.get(state, 0.0) + probability * share
+
+    # 6-6: the first player serves the first tiebreak point and the set ends after 13 games
+    tiebreak = reach.get((6, 6), 0.0)
+    first_odd = first_odd + tiebreak * tiebreak_first
+    second_odd = second_odd + tiebreak * (1 - tiebreak_first)
+    return first_even, first_odd, second_even, second_odd
+
+
+def match_outcomes(pa, pb, best_of: int = 3) -> Dict[str, np.ndarray]:
+    """Set and match win probabilities for A, averaged over who serves first."""
+    hold_a, hold_b = hold_probability(pa), hold_probability(pb)
+    a_first = set_outcomes(hold_a, hold_b, tiebreak_probability(pa, pb))
+    b_first = set_outcomes(hold_b, hold_a, tiebreak_probability(pb, pa))
+    # per first server: (A wins, next first server), (B wins, next first server), as probabilities
+    transitions = {
+        'A': [(1, 0, 'A', a_first[0]), (1, 0, 'B', a_first[1]), (0, 1, 'A', a_first[2]), (0, 1, 'B', a_first[3])],
+        'B': [(0, 1, 'B', b_first[0]), (0, 1, 'A', b_first[1]), (1, 0, 'B', b_first[2]), (1, 0, 'A', b_first[3])],
+    }
+
+    needed = best_of // 2 + 1
+    ones = np.ones(np.broadcast(pa, pb).shape)
+    match = 0.0
+    for opening in ('A', 'B'):
+        reach = {(0, 0, opening): ones * 0.5}
+        for sets in range(2 * needed - 1):
+            for (a, b, server), probability in [(key, value) for key, value in reach.items() if sum(key[:2]) == sets]:
+                del reach[(a, b, server)]
+                for add_a, add_b, next_server, share in transitions[server]:
+                    state = (a + add_a, b + add_b, next_server)
+                    if state[0] == needed:
+                        match = match + probability * share
+                    elif state[1] < needed:
+                        reach[state] = reach.get(state, 0.0) + probability * share
+
+    return {
+        'set': 0.5 * (a_first[0] + a_first[1]) + 0.5 * (b_first[2] + b_first[3]),
+        'match': match,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def outcome_grid(best_of: int = 3, low: float = GRID_LOW, high: float = GRID_HIGH,
+                 step: float = GRID_STEP) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """(axis, {'set': grid, 'match': grid}) with grid[i, j] the value at pa = axis[i], pb = axis[j]."""
+    axis = np.round(np.arange(low, high + step / 2, step), 10)
+    pa, pb = np.meshgrid(axis, axis, indexing='ij')
+    return axis, match_outcomes(pa, pb, best_of)
+
+
+def interpolate(axis: np.ndarray, grid: np.ndarray, pa: np.ndarray, pb: np.ndarray) -> np.ndarray:
+    """Bilinear interpolation on a regular axis; inputs are clipped to the grid."""
+    step = axis[1] - axis[0]
+    x = (np.clip(pa, axis[0], axis[-1]) - axis[0]) / step
+    y = (np.clip(pb, axis[0], axis[-1]) - axis[0]) / step
+    i = np.minimum(x.astype(np.int64), len(axis) - 2)
+    j = np.minimum(y.astype(np.int64), len(axis) - 2)
+    dx, dy = x - i, y - j
+    return ((1 - dx) * (1 - dy) * grid[i, j] + dx * (1 - dy) * grid[i + 1, j]
+            + (1 - dx) * dy * grid[i, j + 1] + dx * dy * grid[i + 1, j + 1])
+
+
+def price_points(pa, pb, best_of=3) -> Dict[str, np.ndarray]:
+    """
+    Hold, set and match probabilities for player A for arrays of serve point rates.
+    best_of may be a scalar or an array of 3s and 5s.
+    """
+    pa, pb = np.asarray(pa, dtype=float), np.asarray(pb, dtype=float)
+    best_of = np.broadcast_to(np.asarray(best_of), pa.shape)
+    prices = {
+        'hold1': hold_probability(pa),
+        'hold2': hold_probability(pb),
+        'set': np.full(pa.shape, np.nan),
+        'match': np.full(pa.shape, np.nan),
+    }
+    for sets in np.unique(best_of):
+        rows = best_of == sets
+        axis, grids = outcome_grid(int(sets))
+        for name in ('set', 'match'):
+            prices[name][rows] = interpolate(axis, grids[name], pa[rows], pb[rows])
+    return prices
+
+
+def rates_from_totals(totals: pd.DataFrame, prior_points: float = PRIOR_POINTS) -> Tuple[pd.DataFrame, float]:
+    """
+    Per-player serve and return point-win rates from serve_won/serve_points/return_won/
+    return_points sums indexed by player id. Returns (rates, tour serve rate). Rates are
+    shrunk toward the tour average by prior_points points.
+    """
+    tour_serve = totals['serve_won'].sum() / totals['serve_points'].sum() if len(totals) else 0.62
+    rates = pd.DataFrame({
+        'serve': (totals['serve_won'] + prior_points * tour_serve) / (totals['serve_points'] + prior_points),
+        'return': (totals['return_won'] + prior_points * (1 - tour_serve)) / (totals['return_points'] + prior_points),
+        'serve_points': totals['serve_points'],
+        'return_points': totals['return_points'],
+    })
+    rates.index = rates.index.astype(np.int64)
+    return rates, float(tour_serve)
+
+
+def matchup_rates(rates: pd.DataFrame, tour_serve: float, id1s, id2s) -> Tuple[np.ndarray, np.ndarray]:
+    """Barnett-Clarke serve point rates (pa, pb) for every pair; NaN where a player has no stats."""
+    lookup = rates.reindex(pd.Series(id1s).astype('Int64').fillna(-1).to_numpy(dtype=np.int64))
+    other = rates.reindex(pd.Series(id2s).astype('Int64').fillna(-1).to_numpy(dtype=np.int64))
+    tour_return = 1 - tour_serve
+    serve1, return1 = lookup['serve'].to_numpy(dtype=float), lookup['return'].to_numpy(dtype=float)
+    serve2, return2 = other['serve'].to_numpy(dtype=float), other['return'].to_numpy(dtype=float)
+    pa = tour_serve + (serve1 - tour_serve) - (return2 - tour_return)
+    pb = tour_serve + (serve2 - tour_serve) - (return1 - tour_return)
+    return pa, pb
+
+
+def match_format(tour: str, tournament_ranks) -> np.ndarray:
+    """Sets per match for each row: 5 at ATP Grand Slams, 3 everywhere else."""
+    ranks = pd.Series(tournament_ranks).astype('Int64').fillna(-1).to_numpy(dtype=np.int64)
+    return np.where((tour == 'atp') & (ranks == GRAND_SLAM_RANK), 5, 3)
+
+
+@timed()
+def price_matchups(rates: pd.DataFrame, tour_serve: float, id1s, id2s, best_of=3) -> Dict[str, np.ndarray]:
+    """Player 1's hold, set and match probabilities; NaN where either player has no stats."""
+    pa, pb = matchup_rates(rates, tour_serve, id1s, id2s)
+    known = ~(np.isnan(pa) | np.isnan(pb))
+    prices = price_points(np.where(known, pa, tour_serve), np.where(known, pb, tour_serve), best_of)
+    return {name: np.where(known, values, np.nan) for name, values in prices.items()}
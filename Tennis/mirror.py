@@ -0,0 +1,167 @@
+"""
+Local SQLite mirror of the OnCourt Access DB.
+
+The first sync copies every table we use. Later syncs only pull the tail of the
+dated tables (games_*, tours_*, ratings_*) from a few days before the last
+watermark, plus the stat_*/odds_* rows of the tournaments that tail touches.
+players_* and today_* are small and change in place, so they are replaced
+wholesale each run.
+
+Point accessDB at the mirror with ONCOURT_BACKEND=mirror (and optionally
+ONCOURT_MIRROR_PATH). Any SQLAlchemy URL can be used as the source, so a SQLite
+stand-in works on machines without the Access driver.
+
+    python mirror.py                 # incremental sync of atp and wta
+    python mirror.py --full          # rebuild from scratch
+    python mirror.py --source sqlite:///oncourt_sample.db
+"""
+import argparse
+import os
+from datetime import timedelta
+
+from sqlalchemy import create_engine, select, func, delete
+from models import metadata
+
+TOURS = ['atp', 'wta']
+
+# table prefix -> column holding the date watermark (None means full refresh)
+DATED_TABLES = {
+    'tours': 'DATE_T',
+    'games': 'DATE_G',
+    'ratings': 'DATE_R',
+}
+TOURNAMENT_TABLES = {
+    'stat': 'ID_T',
+    'odds': 'ID_T_O',
+}
+REPLACED_TABLES = ['players', 'today']
+
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'oncourt_mirror.db')
+BATCH_SIZE = 10_000
+IN_CHUNK = 500
+
+
+def access_url(db_path=None, db_password=None, read_only=False):
+    db_path = db_path or os.environ.get('ONCOURT_DB_PATH')
+    db_password = db_password or os.environ.get('ONCOURT_DB_PASSWORD')
+    read_only_flag = ";ReadOnly=1" if read_only else ""
+    return f"access+pyodbc:///?odbc_connect=DRIVER={{Microsoft Access Driver (*.mdb, *.accdb)}};DBQ={db_path};PWD={db_password}{read_only_flag}"
+
+
+def mirror_path():
+    return os.environ.get('ONCOURT_MIRROR_PATH', DEFAULT_MIRROR_PATH)
+
+
+def mirror_url(path=None, read_only=False):
+    if read_only:
+        return f"sqlite:///file:{path or mirror_path()}?mode=ro&uri=true"
+    return f"sqlite:///{path or mirror_path()}"
+
+
+def _copy_rows(source_conn, mirror_conn, table, query):
+    result = source_conn.execute(query)
+    copied = 0
+    while True:
+        rows = result.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        mirror_conn.execute(table.insert(), [dict(row._mapping) for row in rows])
+        copied += len(rows)
+    return copied
+
+
+def _watermark(mirror_conn, table, date_column):
+    return mirror_conn.execute(select(func.max(table.c[date_column]))).scalar()
+
+
+def sync_tour(tour, source_engine, mirror_engine, full=False, overlap_days=14):
+    """
+    Brings the mirror tables of one tour up to date and returns {table_name: rows_copied}.
+
+    Rows dated within overlap_days of the previous watermark are deleted and pulled
+    again, so results entered late by the OnCourt client still make it across.
+    """
+    tables = {prefix: metadata.tables[f'{prefix}_{tour}']
+              for prefix in [*DATED_TABLES, *TOURNAMENT_TABLES, *REPLACED_TABLES]}
+    counts = {}
+
+    with source_engine.connect() as source_conn, mirror_engine.begin() as mirror_conn:
+        cutoffs = {}
+        for prefix, date_column in DATED_TABLES.items():
+            table = tables[prefix]
+            watermark = None if full else _watermark(mirror_conn, table, date_column)
+            if watermark is None:
+                mirror_conn.execute(delete(table))
+                query = select(table)
+            else:
+                cutoff = watermark - timedelta(days=overlap_days)
+                cutoffs[prefix] = cutoff
+                mirror_conn.execute(delete(table).where(table.c[date_column] >= cutoff))
+                query = select(table).where(table.c[date_column] >= cutoff)
+            counts[table.name] = _copy_rows(source_conn, mirror_conn, table, query)
+
+        # stat/odds carry no date, so refresh them per tournament touched by the new tail
+        if 'games' in cutoffs and 'tours' in cutoffs:
+            games, tours = tables['games'], tables['tours']
+            tournament_ids = set(source_conn.execute(
+                select(games.c.ID_T_G).where(games.c.DATE_G >= cutoffs['games']).distinct()
+            ).scalars())
+            tournament_ids.update(source_conn.execute(
+                select(tours.c.ID_T).where(tours.c.DATE_T >= cutoffs['tours'])
+            ).scalars())
+            # today_* is replaced wholesale, so its events need fresh odds even before any result
+            today = tables['today']
+            tournament_ids.update(int(tour_id) for tour_id in source_conn.execute(
+                select(today.c.TOUR).distinct()
+            ).scalars() if tour_id is not None and str(tour_id).strip().isdigit())
+            tournament_ids = sorted(tournament_ids)
+        else:
+            tournament_ids = None
+
+        for prefix, id_column in TOURNAMENT_TABLES.items():
+            table = tables[prefix]
+            if tournament_ids is None:
+                mirror_conn.execute(delete(table))
+                counts[table.name] = _copy_rows(source_conn, mirror_conn, table, select(table))
+                continue
+            counts[table.name] = 0
+            for i in range(0, len(tournament_ids), IN_CHUNK):
+                chunk = tournament_ids[i:i + IN_CHUNK]
+                mirror_conn.execute(delete(table).where(table.c[id_column].in_(chunk)))
+                counts[table.name] += _copy_rows(
+                    source_conn, mirror_conn, table, select(table).where(table.c[id_column].in_(chunk))
+                )
+
+        for prefix in REPLACED_TABLES:
+            table = tables[prefix]
+            mirror_conn.execute(delete(table))
+            counts[table.name] = _copy_rows(source_conn, mirror_conn, table, select(table))
+
+    return counts
+
+
+def sync(source_url=None, path=None, tours=TOURS, full=False, overlap_days=14):
+    source_engine = create_engine(source_url or access_url(read_only=True))
+    mirror_engine = create_engine(mirror_url(path))
+    metadata.create_all(mirror_engine, tables=[metadata.tables[f'{prefix}_{tour}']
+                                               for tour in tours
+                                               for prefix in [*DATED_TABLES, *TOURNAMENT_TABLES, *REPLACED_TABLES]])
+    try:
+        return {tour: sync_tour(tour, source_engine, mirror_engine, full, overlap_days) for tour in tours}
+    finally:
+        source_engine.dispose()
+        mirror_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the OnCourt Access DB into a local SQLite mirror")
+    parser.add_argument('--tour', choices=TOURS, action='append', help="defaults to both tours")
+    parser.add_argument('--full', action='store_true', help="drop the mirror contents and copy everything")
+    parser.add_argument('--source', help="SQLAlchemy URL of the source DB (defaults to ONCOURT_DB_PATH via pyodbc)")
+    parser.add_argument('--path', help="mirror file (defaults to ONCOURT_MIRROR_PATH or oncourt_mirror.db)")
+    parser.add_argument('--overlap-days', type=int, default=14)
+    args = parser.parse_args()
+
+    for tour, counts in sync(args.source, args.path, args.tour or TOURS, args.full, args.overlap_days).items():
+        for table_name, copied in counts.items():
+            print(f"{table_name}: {copied} rows")
@@ -0,0 +1,107 @@
+"""
+Versioned on-disk format for EloEngine models, replacing pickle.
+
+A model is a directory of plain .npy arrays plus a meta.json:
+
+    meta.json               format_version, parameters, watermark, sizes
+    ratings.npy             float64 (players x 7), memory-mapped on load
+    player_ids.npy          int64, dense index -> OnCourt id
+    names.json              dense index -> player name
+    history_<column>.npy    the RatingHistory columns, read only when history is first used
+
+Nothing here depends on the Python class layout, so models survive refactors of EloEngine.
+"""
+import functools
+import json
+import os
+import shutil
+from typing import Optional
+
+import numpy as np
+
+from eloEngine import EloEngine, RATING_COLUMNS
+from ratingHistory import COLUMN_DTYPES, RatingHistory
+from timings import timed
+
+FORMAT_VERSION = 1
+
+
+@timed()
+def save_model(model: EloEngine, path: str):
+    """Writes model to the directory path, replacing any previous model there in one rename."""
+    staging = path + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'k_factor': model.k_factor,
+        'initial_elo': model.initial_elo,
+        'start_low': model.start_low,
+        'start_lowest': model.start_lowest,
+        'blend': model.blend,
+        'rating_columns': RATING_COLUMNS,
+        'n_players': model.n_players,
+        'last_day': model.last_day,
+        'last_day_keys': sorted(list(key) for key in model.last_day_keys),
+        'history_rows': len(model.history),
+    }
+    with open(os.path.join(staging, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=2)
+    with open(os.path.join(staging, 'names.json'), 'w', encoding='utf-8') as file:
+        json.dump([str(name) for name in model.names], file, ensure_ascii=False)
+    np.save(os.path.join(staging, 'ratings.npy'), np.ascontiguousarray(model.ratings))
+    np.save(os.path.join(staging, 'player_ids.npy'), np.asarray(model.player_ids, dtype=np.int64))
+    for name, column in model.history.columns().items():
+        np.save(os.path.join(staging, f'history_{name}.npy'), column)
+
+    previous = path + '.old'
+    if os.path.exists(path):
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+@timed()
+def load_history(path: str) -> RatingHistory:
+    columns = [np.load(os.path.join(path, f'history_{name}.npy')) for name in COLUMN_DTYPES]
+    return RatingHistory.from_columns(*columns)
+
+
+def read_meta(path: str) -> dict:
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+    if meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"{path} has model format {meta.get('format_version')}, expected {FORMAT_VERSION}")
+    if meta['rating_columns'] != RATING_COLUMNS:
+        raise ValueError(f"{path} was saved with rating columns {meta['rating_columns']}")
+    return meta
+
+
+@timed()
+def load_model(path: str, mmap: bool = True, history: Optional[bool] = None) -> EloEngine:
+    """
+    Loads a model saved by save_model. With mmap the ratings are memory-mapped read-only, so
+    only the pages that are looked up get read; a later fit swaps in an in-memory copy.
+    History is loaded on first access unless history=True (now) or False (never, empty).
+    Pass mmap=False when the model will be saved back to the same path, or is held by a
+    long-running process: on Windows an open mapping makes save_model's rename fail.
+    """
+    meta = read_meta(path)
+    # start_low/start_lowest/blend were added later; older models used the defaults
+    model = EloEngine(k_factor=meta['k_factor'], initial_elo=meta['initial_elo'], start_low=meta.get('start_low'),
+                      start_lowest=meta.get('start_lowest'), blend=meta.get('blend', 1.0))
+    model.ratings = np.load(os.path.join(path, 'ratings.npy'), mmap_mode='r' if mmap else None)
+    model.player_ids = np.load(os.path.join(path, 'player_ids.npy')).tolist()
+    with open(os.path.join(path, 'names.json'), encoding='utf-8') as file:
+        model.names = json.load(file)
+    model.index = dict(zip(model.player_ids, range(len(model.player_ids))))
+    model.last_day = meta['last_day']
+    model.last_day_keys = {tuple(key) for key in meta['last_day_keys']}
+
+    if history is None:
+        model.history_loader = functools.partial(load_history, path)
+    elif history:
+        model.history_store = load_history(path)
+    return model
@@ -1,9 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import Dict, List
-from datetime import datetime
-from accessDB import get_matches_in_daterange, get_player_id
-import pandas as pd
-import pickle
+from typing import Dict, List, Tuple
+from datetime import datetime, timedelta
+from accessDB import iter_matches_in_daterange
+from playerDirectory import get_directory
+from eloEngine import EloEngine
+from modelStore import save_model, load_model
+from timings import profile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 
 class Player(BaseModel):
@@ -111,63 +115,33 @@ class EloModel:
             player2.name: expected_score2
         }
 
-elo = EloModel()
-
-def load_data(tour, start_date: str, end_date: str):
-    matches = get_matches_in_daterange(
+def load_data(model: EloEngine, tour, start_date: str, end_date: str, chunk_size: int = 50_000):
+    """
+    Streams matches in date order into model and returns how many were applied.
+    Matches the model has already seen are skipped.
+    """
+    processed = 0
+    for matches in iter_matches_in_daterange(
         tour,
         datetime.strptime(start_date, '%Y-%m-%d'),
-        datetime.strptime(end_date, '%Y-%m-%d')
-    )
-    matches = pd.DataFrame(matches).sort_values(by='DATE_G')
-    for _, match in matches.iterrows():
-        winner_id = match['ID1_G']
-        loser_id = match['ID2_G']
-        winner_name = match['player1_name']
-        loser_name = match['player2_name']
-
-        elo.add_player(winner_id, winner_name)
-        elo.add_player(loser_id, loser_name)
-    
-        winner = elo.get_player(winner_id)
-        loser = elo.get_player(loser_id)
-        match_obj = Match(winner=winner, loser=loser, date=match['DATE_G'])
-        elo.update_elo(match_obj)
-        elo.update_surface_elo(match['surface'], match_obj)
-
-    return matches
-
-#refactor some other time
-# def plot_elo_history(tour, player_names: List[str], elo_type: str = 'overall'):
-#     for player_name in player_names:
-#         player_id = player_name_to_id(tour, player_name)
-#         player = elo.get_player(player_id)
-#         if not player:
-#             raise ValueError(f"Player {player_name} not found in the ELO system.")
-
-#         dates = list(player.elo_history[elo_type].keys())
-#         elos = list(player.elo_history[elo_type].values())
-
-#         plt.plot(dates, elos, marker='o', linestyle='-', label=player_name)
-
-#     plt.title('ELO Rating History')
-#     plt.xlabel('Date')
-#     plt.ylabel('ELO Rating')
-#     plt.legend()
-#     plt.grid(True)
-#     plt.show()
-
-def plot_elo_history(tour, player_names: List[str], elo_type: str = 'overall'):
-    for player_name in player_names:
-        player_id = get_player_id(tour, player_name)
-        player = elo.get_player(player_id)
-        if not player:
+        datetime.strptime(end_date, '%Y-%m-%d'),
+        chunk_size=chunk_size
+    ):
+        overall_probs, _ = model.fit(matches)
+        processed += len(overall_probs)
+
+    return processed
+
+def plot_elo_history(model: EloEngine, tour, player_names: List[str], elo_type: str = 'overall'):
+    # exact lookups only: a fuzzy match could quietly plot someone else
+    player_ids = get_directory(tour).resolve_many(player_names, fuzzy=False)
+    for player_name, player_id in zip(player_names, player_ids):
+        if player_id is None or model.get_elo(player_id) is None:
             raise ValueError(f"Player {player_name} not found in the ELO system.")
 
-        dates = list(player.elo_history[elo_type].keys())
-        elos = list(player.elo_history[elo_type].values())
+        history = model.get_history(player_id, elo_type)
 
-        plt.plot(dates, elos, marker='o', linestyle='-', label=player_name)
+        plt.plot(history.index, history.values, marker='o', linestyle='-', label=player_name)
 
     plt.title('ELO Rating History')
     plt.xlabel('Date')
@@ -176,43 +150,93 @@ def plot_elo_history(tour, player_names: List[str], elo_type: str = 'overall'):
     plt.grid(True)
     plt.show()
 
-# Example usage
-
-
-#refactor some other time
-# def get_elo_history_df(tour, player_name: str) -> pd.DataFrame:
-#     player_id = player_name_to_id(tour, player_name)
-#     player = elo.get_player(player_id)
-
-#     if not player:
-#         raise ValueError(f"Player {player_name} not found in the ELO system.")
-
-#     data = {
-#         'Date': list(player.elo_history.keys()),
-#         'ELO': list(player.elo_history.values())
-#     }
-
-#     return pd.DataFrame(data)
-
-def main(tour: str, start_date: str, end_date: str):
-    load_data(tour, start_date, end_date)
-
-    for player in elo.players.values():
-        print(f"Player: {player.name}, ELO: {player.elo['overall']}")
-
-def save_elo_model(filename: str):
-
-    with open(filename, 'wb') as file:
-        pickle.dump(elo, file)
-
-def load_elo_model(filename: str) -> EloModel:
-    with open(filename, 'rb') as file:
-        return pickle.load(file)
+def main(tour: str, start_date: str, end_date: str) -> EloEngine:
+    model = EloEngine()
+    load_data(model, tour, start_date, end_date)
+
+    for player in model.summary().itertuples():
+        print(f"Player: {player.name}, ELO: {player.overall}")
+    return model
+
+def save_elo_model(model: EloEngine, filename: str):
+    save_model(model, filename)
+
+def load_elo_model(filename: str, mmap: bool = True) -> EloEngine:
+    return load_model(filename, mmap=mmap)
+
+def update(tour: str, filename: str, end_date: str = None) -> int:
+    """
+    Applies the matches played since the saved model's watermark and saves it back.
+    The pull starts on the watermark day itself; matches already applied that day are skipped.
+    """
+    model = load_elo_model(filename, mmap=False)
+    if model.last_date is None:
+        raise ValueError(f"{filename} has no watermark, run a full fit first")
+    if end_date is None:
+        end_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    applied = load_data(model, tour, model.last_date.strftime('%Y-%m-%d'), end_date)
+    if applied:
+        save_elo_model(model, filename)
+    return applied
+
+def fit_model(tour: str, start_date: str, end_date: str, filename: str, k_factor: float = 32,
+              start_low: float = None, start_lowest: float = None, blend: float = 1.0) -> Tuple[str, int]:
+    """
+    Fits a fresh model and writes it to filename. Returns (filename, matches applied). An
+    empty fit is not saved, so it can never replace a good model.
+    """
+    model = EloEngine(k_factor=k_factor, start_low=start_low, start_lowest=start_lowest, blend=blend)
+    applied = load_data(model, tour, start_date, end_date)
+    if applied:
+        save_elo_model(model, filename)
+    return filename, applied
+
+def fit_all(jobs: List[Dict], workers: int = None) -> Dict[str, int]:
+    """
+    Runs fit_model(**job) for every job in its own worker process, e.g. ATP and WTA side by side
+    or several K factors for one tour. Returns {filename: matches applied}.
+    """
+    with ProcessPoolExecutor(max_workers=workers or len(jobs)) as pool:
+        futures = [pool.submit(fit_model, **job) for job in jobs]
+        return dict(future.result() for future in futures)
     
 if __name__ == "__main__":
-    tour = 'wta'
-    start_date = '2021-01-01'
-    end_date = '2024-10-16'
-    main(tour, start_date, end_date)
-    save_elo_model(f'elo_model_{tour}.pkl')
-
+    parser = argparse.ArgumentParser(description="Fit Elo models from scratch or update saved ones")
+    parser.add_argument('command', nargs='?', choices=['fit', 'update'], default='fit')
+    parser.add_argument('--tour', choices=['atp', 'wta'], action='append', help="defaults to both tours")
+    parser.add_argument('--start', default='2021-01-01')
+    parser.add_argument('--end', default=None, help="defaults to yesterday")
+    parser.add_argument('--k-factor', type=float, action='append',
+                        help="repeat to fit variants, saved as elo_model_<tour>_k<K>")
+    parser.add_argument('--start-low', type=float, default=None,
+                        help="starting rating for players first seen at RANK_T 0/1 (default 1500)")
+    parser.add_argument('--start-lowest', type=float, default=None,
+                        help="starting rating for players first seen at RANK_T 6 (default 1500)")
+    parser.add_argument('--blend', type=float, default=1.0,
+                        help="weight of the overall rating in the app's Model price; the rest is surface")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    tours = args.tour or ['atp', 'wta']
+    with profile(f'naiveElo-{args.command}'):
+        if args.command == 'fit':
+            end_date = args.end or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            k_factors = args.k_factor or [32]
+            jobs = [
+                {
+                    'tour': tour, 'start_date': args.start, 'end_date': end_date, 'k_factor': k_factor,
+                    'start_low': args.start_low, 'start_lowest': args.start_lowest, 'blend': args.blend,
+                    'filename': f'elo_model_{tour}' if len(k_factors) == 1 else f'elo_model_{tour}_k{k_factor:g}',
+                }
+                for tour in tours for k_factor in k_factors
+            ]
+            for filename, applied in fit_all(jobs, args.workers).items():
+                if applied:
+                    print(f"Fitted {filename} on {applied} matches")
+                else:
+                    print(f"No matches found for {filename}, kept the saved model")
+        else:
+            for tour in tours:
+                filename = f'elo_model_{tour}'
+                print(f"Applied {update(tour, filename, args.end)} new matches to {filename}")
@@ -0,0 +1,112 @@
+"""
+In-memory player directory: one players_* read per tour, then O(1) name <-> id lookups.
+
+Names are matched after stripping accents, case and punctuation, so 'Sérena  WILLIAMS'
+finds 'Serena Williams'. aliases.csv (alias,name rows next to replacements.csv) maps
+spellings from other sources onto OnCourt names, and a fuzzy fallback catches the
+remaining typos.
+"""
+import csv
+import difflib
+import os
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+from accessDB import get_players
+
+DEFAULT_ALIASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aliases.csv')
+
+
+def normalize_name(name: str) -> str:
+    text = unicodedata.normalize('NFKD', str(name))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = ''.join(ch if ch.isalnum() else ' ' for ch in text.lower())
+    return ' '.join(text.split())
+
+
+def load_aliases(path: str) -> Dict[str, str]:
+    aliases = {}
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if len(row) >= 2 and row[0].strip() and [cell.strip() for cell in row[:2]] != ['alias', 'name']:
+                aliases[normalize_name(row[0])] = normalize_name(row[1])
+    return aliases
+
+
+class PlayerDirectory:
+    def __init__(self, ids: Iterable[int], names: Iterable[str], aliases: Optional[Dict[str, str]] = None,
+                 fuzzy_cutoff: float = 0.85):
+        self.id_to_name: Dict[int, str] = {}
+        self.name_to_id: Dict[str, int] = {}
+        # name token -> normalised names containing it; narrows the fuzzy search to a few candidates
+        self.token_index: Dict[str, List[str]] = {}
+        for player_id, name in zip(ids, names):
+            player_id = int(player_id)
+            self.id_to_name[player_id] = name
+            key = normalize_name(name)
+            if key in self.name_to_id:
+                continue
+            self.name_to_id[key] = player_id
+            for token in key.split():
+                self.token_index.setdefault(token, []).append(key)
+        self.aliases = aliases or {}
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fuzzy_cache: Dict[str, Optional[int]] = {}
+
+    @classmethod
+    def from_db(cls, tour: str, aliases_path: Optional[str] = DEFAULT_ALIASES_PATH) -> 'PlayerDirectory':
+        players = get_players(tour)
+        if players is None:
+            raise ValueError(f"Could not load players for {tour}")
+        aliases = load_aliases(aliases_path) if aliases_path and os.path.exists(aliases_path) else None
+        return cls(players['ID_P'], players['NAME_P'], aliases)
+
+    def get_name(self, player_id: int) -> Optional[str]:
+        return self.id_to_name.get(int(player_id))
+
+    def get_id(self, name: str, fuzzy: bool = True) -> Optional[int]:
+        key = normalize_name(name)
+        key = self.aliases.get(key, key)
+        player_id = self.name_to_id.get(key)
+        if player_id is None and fuzzy:
+            player_id = self.fuzzy_match(key)
+        return player_id
+
+    def fuzzy_match(self, key: str) -> Optional[int]:
+        if key in self.fuzzy_cache:
+            return self.fuzzy_cache[key]
+
+        candidates = {name for token in key.split() for name in self.token_index.get(token, [])}
+        if candidates:
+            matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+            best_ratio, best_name = 0.0, None
+            for name in candidates:
+                matcher.set_seq1(name)
+                if matcher.real_quick_ratio() < self.fuzzy_cutoff or matcher.quick_ratio() < self.fuzzy_cutoff:
+                    continue
+                ratio = matcher.ratio()
+                if ratio > best_ratio:
+                    best_ratio, best_name = ratio, name
+            matches = [best_name] if best_ratio >= self.fuzzy_cutoff else []
+        else:
+            matches = []
+        if not matches:
+            # misspelt in every token, so fall back to scanning every name
+            matches = difflib.get_close_matches(key, self.name_to_id.keys(), n=1, cutoff=self.fuzzy_cutoff)
+
+        player_id = self.name_to_id[matches[0]] if matches else None
+        self.fuzzy_cache[key] = player_id
+        return player_id
+
+    def resolve_many(self, names: Iterable[str], fuzzy: bool = True) -> List[Optional[int]]:
+        return [self.get_id(name, fuzzy) for name in names]
+
+
+directories: Dict[str, PlayerDirectory] = {}
+
+
+def get_directory(tour: str) -> PlayerDirectory:
+    """Returns the directory for a tour, loading it from the DB on first use."""
+    if tour not in directories:
+        directories[tour] = PlayerDirectory.from_db(tour)
+    return directories[tour]
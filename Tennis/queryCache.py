@@ -0,0 +1,130 @@
+"""
+Result cache for the accessDB query functions.
+
+Entries are keyed on function name plus arguments, evicted least-recently-used once
+there are more than maxsize of them or they hold more than max_bytes, expire after ttl
+seconds, and are all dropped as soon as the stamp function (mtime and size of the DB
+file) reports a change. A result bigger than max_bytes on its own, such as a multi-year
+match pull, is returned but never stored.
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def freeze(value):
+    """Turns list/set/dict arguments into hashable keys. Raises TypeError for anything else unhashable."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(freeze(item) for item in value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    hash(value)
+    return value
+
+
+def result_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return 0
+
+
+def copy_result(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    return value
+
+
+class QueryCache:
+    def __init__(self, maxsize=128, ttl=600, stamp=None, max_bytes=256 * 2**20):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.ttl = ttl
+        self.stamp = stamp
+        self.entries = OrderedDict()
+        self.last_stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self.lock = threading.Lock()
+
+    def check_stamp(self):
+        if self.stamp is None:
+            return
+        current = self.stamp()
+        if current != self.last_stamp:
+            self.entries.clear()
+            self.bytes = 0
+            self.last_stamp = current
+
+    def get(self, key):
+        with self.lock:
+            self.check_stamp()
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self.bytes -= self.entries.pop(key)[3]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.seconds_saved += entry[2]
+            return entry
+
+    def put(self, key, value, elapsed):
+        size = result_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[3]
+            self.entries[key] = (time.monotonic(), copy_result(value), elapsed, size)
+            self.bytes += size
+            while len(self.entries) > self.maxsize or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'seconds_saved': self.seconds_saved,
+        }
+
+    def cached(self, func):
+        """Decorator caching func's results. Calls with unhashable arguments and None results are not cached."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                key = (func.__name__, freeze(args), freeze(kwargs))
+            except TypeError:
+                return func(*args, **kwargs)
+
+            entry = self.get(key)
+            if entry is not None:
+                return copy_result(entry[1])
+
+            started = time.perf_counter()
+            value = func(*args, **kwargs)
+            if value is not None:
+                self.put(key, value, time.perf_counter() - started)
+            return value
+
+        wrapper.cache = self
+        return wrapper
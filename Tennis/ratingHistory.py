@@ -0,0 +1,132 @@
+"""
+Columnar rating history.
+
+Every rating change is one row of (player index, day, surface code, rating) appended to
+four typed arrays that grow by doubling, so a long fit costs amortised O(1) per row and
+the whole log pickles or saves as four flat buffers. Surface code 0 is the overall rating.
+Rows are in processing order, which is date order, so "as of day d" means "last row with
+day <= d".
+
+HistoryIndex sorts a snapshot of the log by (player, surface, day) so as-of lookups for
+whole arrays of players and dates are one binary search each instead of a scan.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+from features import DAY_OFFSET, pack_keys
+
+COLUMN_DTYPES = {
+    'player': np.int32,
+    'day': np.int64,
+    'surface': np.int8,
+    'rating': np.float64,
+}
+
+
+class RatingHistory:
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        self.buffers: Dict[str, np.ndarray] = {name: np.empty(capacity, dtype=dtype)
+                                               for name, dtype in COLUMN_DTYPES.items()}
+
+    @classmethod
+    def from_columns(cls, player, day, surface, rating) -> 'RatingHistory':
+        history = cls(capacity=0)
+        history.extend(player, day, surface, rating)
+        return history
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getstate__(self):
+        # pickle only the used part of the buffers
+        return {'columns': {name: np.array(column) for name, column in self.columns().items()}}
+
+    def __setstate__(self, state):
+        self.size = 0
+        self.buffers = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+        self.extend(*state['columns'].values())
+
+    def extend(self, player, day, surface, rating):
+        count = len(player)
+        needed = self.size + count
+        capacity = len(self.buffers['player'])
+        if needed > capacity:
+            capacity = max(needed, 2 * capacity, 1024)
+            for name, buffer in self.buffers.items():
+                grown = np.empty(capacity, dtype=buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                self.buffers[name] = grown
+        for name, values in zip(COLUMN_DTYPES, (player, day, surface, rating)):
+            self.buffers[name][self.size:needed] = values
+        self.size = needed
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Views of the filled part of each column; they are invalidated by the next extend."""
+        return {name: buffer[:self.size] for name, buffer in self.buffers.items()}
+
+    def series(self, player: int, surface: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """(days, ratings) of one player on one surface, keeping the last rating of each day."""
+        columns = self.columns()
+        rows = np.flatnonzero((columns['player'] == player) & (columns['surface'] == surface))
+        days = columns['day'][rows]
+        last_of_day = np.append(days[1:] != days[:-1], True) if len(days) else np.ones(0, dtype=bool)
+        return days[last_of_day], columns['rating'][rows[last_of_day]]
+
+    def on_date(self, day: int, surface: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """(players, ratings) for every player rated on or before day, as of that day."""
+        columns = self.columns()
+        rows = np.flatnonzero((columns['day'] <= day) & (columns['surface'] == surface))
+        # last occurrence of each player: unique over the reversed rows gives first-from-the-end
+        players, last_from_end = np.unique(columns['player'][rows][::-1], return_index=True)
+        return players, columns['rating'][rows[::-1][last_from_end]]
+
+    def top_n(self, day: int, n: int = 10, surface: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """The n highest (players, ratings) as of day, best first."""
+        players, ratings = self.on_date(day, surface)
+        if len(ratings) > n:
+            best = np.argpartition(-ratings, n - 1)[:n]
+            players, ratings = players[best], ratings[best]
+        order = np.argsort(-ratings, kind='stable')
+        return players[order], ratings[order]
+
+
+class HistoryIndex:
+    """
+    The history sorted by (player, surface, day), answering "rating of player p on surface s
+    as of day d" for whole arrays of (p, s, d). Player and surface share the high bits of the
+    packed key, so it is the same searchsorted as features.RankingIndex.
+    """
+    def __init__(self, history: RatingHistory):
+        columns = history.columns()
+        self.size = len(history)
+        series = self.series_keys(columns['player'], columns['surface'])
+        # stable, so rows of the same day keep processing order and the last one wins
+        order = np.argsort(pack_keys(series, columns['day']), kind='stable')
+        self.series = series[order]
+        self.keys = pack_keys(self.series, columns['day'][order])
+        self.ratings = columns['rating'][order]
+
+    @staticmethod
+    def series_keys(players, surfaces) -> np.ndarray:
+        return (np.asarray(players, dtype=np.int64) << 3) | np.asarray(surfaces, dtype=np.int64)
+
+    def lookup(self, players, days, surfaces=0, strict: bool = True) -> np.ndarray:
+        """
+        Ratings aligned to the inputs, NaN where the player had no rating on that surface yet
+        (or the player index is negative). strict=True means before day d, i.e. the pre-match
+        rating for a match on d; strict=False includes the updates made on d.
+        """
+        players = np.asarray(players, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        surfaces = np.broadcast_to(np.asarray(surfaces, dtype=np.int64), players.shape)
+        if not len(self.keys):
+            return np.full(len(players), np.nan)
+
+        series = self.series_keys(players, surfaces)
+        rows = np.searchsorted(self.keys, pack_keys(series, days), side='left' if strict else 'right') - 1
+        found = (rows >= 0) & (players >= 0) & (days > -DAY_OFFSET)
+        rows = np.where(found, rows, 0)
+        found &= self.series[rows] == series
+        return np.where(found, self.ratings[rows], np.nan)
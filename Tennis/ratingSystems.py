@@ -0,0 +1,344 @@
+"""
+Several rating systems fitted side by side in one pass over a MatchStream.
+
+Each RatingSystem keeps its own per-player state in flat Python lists indexed by the
+dense player index (cheap to index inside the loop, like EloEngine.process). For every
+match, MultiRatingEngine calls each system's step, which returns the winner's pre-match
+probability and applies the result. Adding a system only adds its own arithmetic to the
+shared loop; the DB read, encoding and iteration are paid once.
+
+    elo          plain Elo, the overall half of EloEngine
+    elo_decay    Elo with K shrinking as a player's match count grows, K = k_max / (n + offset) ** shape
+    elo_surface  overall and surface Elo priced on a blend of the two rating differences
+    glicko2      Glicko-2, treating every match as its own rating period
+
+    python ratingSystems.py --tour atp --start 2015-01-01
+"""
+import argparse
+import math
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from accessDB import iter_matches_in_daterange
+from eloEngine import EloEngine, MatchStream, RATING_COLUMNS, surface_codes
+from eloSweep import score
+from timings import timed
+
+GLICKO_SCALE = 400 / math.log(10)
+
+
+def known(values: np.ndarray, rows: np.ndarray, default: float) -> np.ndarray:
+    """values[rows], with default where the row is -1 (a player the systems have not seen)."""
+    if not len(values):
+        return np.full(len(rows), default)
+    return np.where(rows >= 0, values[np.maximum(rows, 0)], default)
+
+
+class RatingSystem(ABC):
+    """
+    Interface for systems driven by MultiRatingEngine. start is called before every pass with
+    the current player count, so state has to grow (keeping what is there) rather than reset.
+    """
+    name = 'rating'
+
+    @abstractmethod
+    def start(self, n_players: int):
+        """Grows the per-player state to n_players."""
+
+    @abstractmethod
+    def step(self, winner: int, loser: int, surface: int, day: int) -> float:
+        """Returns the winner's pre-match win probability, then applies the result."""
+
+    @abstractmethod
+    def predict(self, rows1: np.ndarray, rows2: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Player 1's win probability for arrays of dense rows (-1 for unseen) and surface codes."""
+
+    @abstractmethod
+    def ratings(self) -> Dict[str, np.ndarray]:
+        """Per-player state as named arrays, for inspection and summaries."""
+
+
+class Elo(RatingSystem):
+    def __init__(self, k_factor: float = 32, initial_elo: float = 1500.0, name: str = 'elo'):
+        self.k_factor = k_factor
+        self.initial_elo = initial_elo
+        self.name = name
+        self.elo: List[float] = []
+
+    def start(self, n_players: int):
+        self.elo += [self.initial_elo] * (n_players - len(self.elo))
+
+    def step(self, winner, loser, surface, day):
+        elo = self.elo
+        winner_elo, loser_elo = elo[winner], elo[loser]
+        expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+        expected_loser = 1 / (1 + 10 ** ((winner_elo - loser_elo) / 400))
+        elo[winner] = winner_elo + self.k_factor * (1 - expected_winner)
+        elo[loser] = loser_elo + self.k_factor * (0 - expected_loser)
+        return expected_winner
+
+    def predict(self, rows1, rows2, codes):
+        elo = np.array(self.elo)
+        difference = known(elo, rows1, self.initial_elo) - known(elo, rows2, self.initial_elo)
+        return 1 / (1 + 10 ** (-difference / 400))
+
+    def ratings(self):
+        return {'elo': np.array(self.elo)}
+
+
+class DecayingKElo(Elo):
+    """
+    Elo whose K falls with the number of matches a player has played, so newcomers move fast
+    and established players slowly. The defaults are the FiveThirtyEight tennis constants.
+    """
+    def __init__(self, k_max: float = 250, offset: float = 5, shape: float = 0.4,
+                 initial_elo: float = 1500.0, name: str = 'elo_decay'):
+        super().__init__(k_max, initial_elo, name)
+        self.offset = offset
+        self.shape = shape
+        self.matches: List[int] = []
+
+    def start(self, n_players: int):
+        super().start(n_players)
+        self.matches += [0] * (n_players - len(self.matches))
+
+    def step(self, winner, loser, surface, day):
+        elo, matches = self.elo, self.matches
+        winner_elo, loser_elo = elo[winner], elo[loser]
+        expected_winner = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+        elo[winner] = winner_elo + self.k_factor / (matches[winner] + self.offset) ** self.shape * (1 - expected_winner)
+        elo[loser] = loser_elo - self.k_factor / (matches[loser] + self.offset) ** self.shape * (1 - expected_winner)
+        matches[winner] += 1
+        matches[loser] += 1
+        return expected_winner
+
+    def ratings(self):
+        return {'elo': np.array(self.elo), 'matches': np.array(self.matches)}
+
+
+class SurfaceElo(RatingSystem):
+    """
+    Overall and per-surface Elo updated as EloEngine does, priced on
+    blend * overall difference + (1 - blend) * surface difference.
+    """
+    def __init__(self, k_factor: float = 32, blend: float = 0.5, initial_elo: float = 1500.0,
+                 name: str = 'elo_surface'):
+        self.k_factor = k_factor
+        self.blend = blend
+        self.initial_elo = initial_elo
+        self.name = name
+        self.width = len(RATING_COLUMNS)
+        self.elo: List[float] = []
+
+    def start(self, n_players: int):
+        self.elo += [self.initial_elo] * (n_players * self.width - len(self.elo))
+
+    def step(self, winner, loser, surface, day):
+        elo, k = self.elo, self.k_factor
+        wo, lo = winner * self.width, loser * self.width
+        difference = elo[wo] - elo[lo]
+        expected_winner = 1 / (1 + 10 ** (-difference / 400))
+        elo[wo] += k * (1 - expected_winner)
+        elo[lo] -= k * (1 - expected_winner)
+        if not surface:
+            return expected_winner
+
+        ws, ls = wo + surface, lo + surface
+        surface_difference = elo[ws] - elo[ls]
+        expected_surface = 1 / (1 + 10 ** (-surface_difference / 400))
+        elo[ws] += k * (1 - expected_surface)
+        elo[ls] -= k * (1 - expected_surface)
+        blended = self.blend * difference + (1 - self.blend) * surface_difference
+        return 1 / (1 + 10 ** (-blended / 400))
+
+    def predict(self, rows1, rows2, codes):
+        elo = np.array(self.elo).reshape(-1, self.width)
+        difference = known(elo[:, 0], rows1, self.initial_elo) - known(elo[:, 0], rows2, self.initial_elo)
+        flat = elo.ravel()
+        surface_difference = (known(flat, np.where(rows1 >= 0, rows1 * self.width + codes, -1), self.initial_elo)
+                              - known(flat, np.where(rows2 >= 0, rows2 * self.width + codes, -1), self.initial_elo))
+        blended = np.where(codes > 0, self.blend * difference + (1 - self.blend) * surface_difference, difference)
+        return 1 / (1 + 10 ** (-blended / 400))
+
+    def ratings(self):
+        elo = np.array(self.elo).reshape(-1, self.width)
+        return {column: elo[:, position] for position, column in enumerate(RATING_COLUMNS)}
+
+
+class Glicko2(RatingSystem):
+    """
+    Glicko-2 (Glickman, 2013) with each match as a one-game rating period for both players,
+    so RD shrinks with every match and grows again by the volatility between matches.
+    State is kept on the internal mu/phi scale; ratings() converts back to rating and RD.
+    """
+    def __init__(self, initial_rating: float = 1500.0, initial_rd: float = 350.0, initial_volatility: float = 0.06,
+                 tau: float = 0.5, tolerance: float = 1e-6, name: str = 'glicko2'):
+        self.initial_rating = initial_rating
+        self.initial_phi = initial_rd / GLICKO_SCALE
+        self.initial_volatility = initial_volatility
+        self.tau = tau
+        self.tolerance = tolerance
+        self.name = name
+        self.mu: List[float] = []
+        self.phi: List[float] = []
+        self.sigma: List[float] = []
+
+    def start(self, n_players: int):
+        added = n_players - len(self.mu)
+        self.mu += [0.0] * added
+        self.phi += [self.initial_phi] * added
+        self.sigma += [self.initial_volatility] * added
+
+    @staticmethod
+    def g(phi: float) -> float:
+        return 1 / math.sqrt(1 + 3 * phi * phi / (math.pi * math.pi))
+
+    def volatility(self, sigma: float, phi: float, v: float, delta: float) -> float:
+        """New volatility by the Illinois iteration of step 5 in the Glicko-2 paper."""
+        a = math.log(sigma * sigma)
+        tau2 = self.tau * self.tau
+
+        def f(x):
+            ex = math.exp(x)
+            return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / tau2
+
+        A = a
+        if delta * delta > phi * phi + v:
+            B = math.log(delta * delta - phi * phi - v)
+        else:
+            k = 1
+            while f(a - k * self.tau) < 0:
+                k += 1
+            B = a - k * self.tau
+        fA, fB = f(A), f(B)
+        while abs(B - A) > self.tolerance:
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            if fC * fB <= 0:
+                A, fA = B, fB
+            else:
+                fA /= 2
+            B, fB = C, fC
+        return math.exp(A / 2)
+
+    def player_update(self, mu, phi, sigma, opponent_mu, opponent_phi, result):
+        g = self.g(opponent_phi)
+        expected = 1 / (1 + math.exp(-g * (mu - opponent_mu)))
+        v = 1 / (g * g * expected * (1 - expected))
+        sigma = self.volatility(sigma, phi, v, v * g * (result - expected))
+        phi = 1 / math.sqrt(1 / (phi * phi + sigma * sigma) + 1 / v)
+        return mu + phi * phi * g * (result - expected), phi, sigma
+
+    def step(self, winner, loser, surface, day):
+        mu, phi, sigma = self.mu, self.phi, self.sigma
+        winner_state = (mu[winner], phi[winner], sigma[winner])
+        loser_state = (mu[loser], phi[loser], sigma[loser])
+        combined = self.g(math.sqrt(winner_state[1] ** 2 + loser_state[1] ** 2))
+        expected_winner = 1 / (1 + math.exp(-combined * (winner_state[0] - loser_state[0])))
+
+        mu[winner], phi[winner], sigma[winner] = self.player_update(*winner_state, *loser_state[:2], 1)
+        mu[loser], phi[loser], sigma[loser] = self.player_update(*loser_state, *winner_state[:2], 0)
+        return expected_winner
+
+    def predict(self, rows1, rows2, codes):
+        mu, phi = np.array(self.mu), np.array(self.phi)
+        phi1, phi2 = known(phi, rows1, self.initial_phi), known(phi, rows2, self.initial_phi)
+        combined = 1 / np.sqrt(1 + 3 * (phi1 ** 2 + phi2 ** 2) / np.pi ** 2)
+        return 1 / (1 + np.exp(-combined * (known(mu, rows1, 0.0) - known(mu, rows2, 0.0))))
+
+    def ratings(self):
+        return {
+            'rating': self.initial_rating + GLICKO_SCALE * np.array(self.mu),
+            'rd': GLICKO_SCALE * np.array(self.phi),
+            'volatility': np.array(self.sigma),
+        }
+
+
+def default_systems() -> List[RatingSystem]:
+    return [Elo(), DecayingKElo(), SurfaceElo(), Glicko2()]
+
+
+class MultiRatingEngine:
+    """
+    Drives a set of RatingSystems over one shared player index. The EloEngine here is only
+    used as the encoder and watermark, so matches are encoded and de-duplicated once.
+    """
+    def __init__(self, systems: Optional[List[RatingSystem]] = None):
+        systems = default_systems() if systems is None else systems
+        self.systems: Dict[str, RatingSystem] = {system.name: system for system in systems}
+        if len(self.systems) != len(systems):
+            raise ValueError("Rating systems need distinct names")
+        self.encoder = EloEngine()
+
+    @timed()
+    def process(self, stream: MatchStream, n_players: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Applies every match to every system in one loop; returns each system's winner probabilities."""
+        n_players = self.encoder.n_players if n_players is None else n_players
+        for system in self.systems.values():
+            system.start(n_players)
+        steps = [system.step for system in self.systems.values()]
+        probs = [[0.0] * len(stream) for _ in steps]
+
+        for i, match in enumerate(zip(stream.winners.tolist(), stream.losers.tolist(),
+                                      stream.surfaces.tolist(), stream.days.tolist())):
+            for column, step in zip(probs, steps):
+                column[i] = step(*match)
+        return {name: np.array(column) for name, column in zip(self.systems, probs)}
+
+    def fit(self, matches: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Feeds a date-ordered match frame, skipping matches already applied. The probabilities
+        line up with encoder.new_matches(matches), as with EloEngine.fit.
+        """
+        matches = self.encoder.new_matches(matches)
+        stream = self.encoder.encode(matches)
+        probs = self.process(stream)
+        self.encoder.advance_watermark(matches, stream.days)
+        return probs
+
+    def fit_daterange(self, tour: str, start_date: datetime, end_date: datetime = None,
+                      chunk_size: int = 50_000) -> Dict[str, np.ndarray]:
+        """Streams a date range from the DB into every system; returns the probabilities of every chunk's fit, joined."""
+        chunks = [self.fit(matches)
+                  for matches in iter_matches_in_daterange(tour, start_date, end_date, chunk_size=chunk_size)]
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0)
+                for name in self.systems}
+
+    @timed()
+    def predict_many(self, id1s, id2s, surfaces=None) -> Dict[str, np.ndarray]:
+        """Player 1's win probability under every system, keyed by system name."""
+        rows1, rows2 = self.encoder.rows_for(id1s), self.encoder.rows_for(id2s)
+        codes = np.zeros(len(rows1), dtype=np.int64) if surfaces is None else surface_codes(surfaces).astype(np.int64)
+        return {name: system.predict(rows1, rows2, codes) for name, system in self.systems.items()}
+
+    def summary(self) -> pd.DataFrame:
+        frame = pd.DataFrame({'id': self.encoder.player_ids, 'name': self.encoder.names})
+        for name, system in self.systems.items():
+            for column, values in system.ratings().items():
+                frame[f'{name}_{column}'] = values
+        return frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit several rating systems in one pass and compare their scores")
+    parser.add_argument('--tour', choices=['atp', 'wta'], default='wta')
+    parser.add_argument('--start', default='2015-01-01')
+    parser.add_argument('--end', default=None, help="defaults to yesterday")
+    parser.add_argument('--burn-in', type=float, default=0.1)
+    args = parser.parse_args()
+
+    engine = MultiRatingEngine()
+    results = engine.fit_daterange(
+        args.tour,
+        datetime.strptime(args.start, '%Y-%m-%d'),
+        datetime.strptime(args.end, '%Y-%m-%d') if args.end else None
+    )
+    if not engine.encoder.n_players:
+        raise SystemExit(f"No {args.tour} matches found from {args.start}")
+    scores = pd.DataFrame({name: score(probs, args.burn_in) for name, probs in results.items()}).T
+    print(f"{len(next(iter(results.values())))} matches, {engine.encoder.n_players} players")
+    print(scores.sort_values('log_loss').to_string())
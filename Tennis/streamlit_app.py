@@ -1,46 +1,46 @@
+import os
 import streamlit as st
 import pandas as pd
-import pickle
-from accessDB import get_upcoming_matches
-from naiveElo import EloModel, Player, Match
-
-def load_elo_model(filename: str):
-    with open(filename, 'rb') as file:
-        return pickle.load(file)
+import numpy as np
+from accessDB import get_upcoming_matches, query_cache
+from modelStore import load_model
+from featureStore import get_feature_store
+from markovPricer import price_matchups, match_format
+from timings import timing_log, timed, stage, profile
 
+# read into memory and without history: the app holds these for its whole life, and a
+# mapped ratings.npy would stop naiveElo update from renaming the new model into place on Windows
 elo_models = {
-    'atp': load_elo_model('elo_model_atp.pkl'),
-    'wta': load_elo_model('elo_model_wta.pkl')
+    'atp': load_model('elo_model_atp', mmap=False, history=False),
+    'wta': load_model('elo_model_wta', mmap=False, history=False)
 }
 
-def calculate_expected_score(p1, p2) -> float:
-    if p1 is None or p2 is None:
-        return None
-    return 1 / (1 + 10 ** ((p2 - p1) / 400))
-
-
-def get_player_elo(player_id, tour, surface='overall'):
-    elo = elo_models[tour]
-    player = elo.get_player(player_id)
-    if not player:
-        return None
-    if surface in player.elo:
-        return player.elo[surface]
-    return player.elo['overall']
+@timed()
+def price_matches(matches, elo, point_rates=None, best_of=3):
+    probs = elo.predict_many(matches['ID1'], matches['ID2'], matches['Surface'])
+    matches['P1 Model'] = np.round(probs['blend'], 2)
+    matches['P2 Model'] = 1 - matches['P1 Model']
+    matches['P1 sModel'] = np.round(probs['surface'], 2)
+    matches['P2 sModel'] = 1 - matches['P1 sModel']
+    # point-level Markov price from serve/return rates; NaN for players without stats
+    markov = np.nan if point_rates is None else \
+        price_matchups(*point_rates, matches['ID1'], matches['ID2'], best_of=best_of)['match']
+    matches['P1 Markov'] = np.round(markov, 2)
+    matches['P2 Markov'] = 1 - matches['P1 Markov']
+    matches['P1 Market'] = matches['P1_Consensus']
+    matches['P2 Market'] = matches['P2_Consensus']
+    return matches[['Player1', 'P1 Model', 'P1 sModel', 'P1 Markov', 'P1 Market',
+                    'Player2', 'P2 Model', 'P2 sModel', 'P2 Markov', 'P2 Market', 'Tournament']]
 
+@timed(first_arg='tour')
 def prepare_data(tour, elo):
+    try:
+        point_rates = get_feature_store(tour).point_rates()
+    except ValueError as e:
+        print(f"An error occurred: {e}")
+        point_rates = None
     matches = get_upcoming_matches(tour)
-    matches['Player1 ELO'] = matches.apply(lambda row: get_player_elo(row['ID1'], tour), axis=1)
-    matches['Player2 ELO'] = matches.apply(lambda row: get_player_elo(row['ID2'], tour), axis=1)
-    matches['P1 Model'] = round(matches.apply(lambda row: calculate_expected_score(row['Player1 ELO'], row['Player2 ELO']), axis=1),2)
-    matches['P2 Model'] = 1 - matches['P1 Model']
-    matches['Player1 sELO'] = matches.apply(lambda row: get_player_elo(row['ID1'], tour, row['Surface']), axis=1)
-    matches['Player2 sELO'] = matches.apply(lambda row: get_player_elo(row['ID2'], tour, row['Surface']), axis=1)
-    matches['P1 sModel'] = round(matches.apply(lambda row: calculate_expected_score(row['Player1 sELO'], row['Player2 sELO']), axis=1),2)
-    matches['P2 sModel'] = 1 - matches['P1 sModel']
-    matches['P1 Market'] = 1 / matches['P1_Odds']
-    matches['P2 Market'] = 1 / matches['P2_Odds']
-    return matches[['Player1', 'P1 Model', 'P1 sModel', 'P1 Market', 'Player2' , 'P2 Model', 'P2 sModel', 'P2 Market', 'Tournament']]
+    return price_matches(matches, elo, point_rates, best_of=match_format(tour, matches['Tournament Rank']))
 
 def format_player_name(player_name, model_value, market_price):
     if model_value > market_price + 0.03:
@@ -48,10 +48,29 @@ def format_player_name(player_name, model_value, market_price):
     else:
         return player_name
 
+def show_timings():
+    """Debug panel: per-stage timings of this run plus the query cache counters."""
+    st.subheader("Timings")
+    st.dataframe(timing_log.summary().round(2), hide_index=True)
+    st.caption(", ".join(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+                         for name, value in query_cache.stats().items()))
+    with st.expander("All records"):
+        st.dataframe(timing_log.frame(), hide_index=True)
+
 def main():
     st.title("Upcoming Matches")
     st.sidebar.title("Filter Matches")
     selected_tour = str.lower(st.sidebar.selectbox("Tour", ['atp', 'wta']))
+    debug = st.sidebar.checkbox("Debug timings", value=os.environ.get('ONCOURT_DEBUG') == '1')
+
+    # Streamlit reruns the script on every interaction, so the log only holds this run
+    timing_log.clear()
+    with profile('streamlit_app'):
+        show_matches(selected_tour)
+    if debug:
+        show_timings()
+
+def show_matches(selected_tour):
     elo = elo_models[selected_tour]
     matches = prepare_data(selected_tour, elo)
     if matches.empty:
@@ -67,11 +86,13 @@ def main():
         return
 
     st.write(f"Matches for {selected_tournament}")
-    match_df = filtered_matches.drop(columns=['Tournament', 'Tour'])
-    match_df['Player1'] = match_df.apply(lambda row: format_player_name(row['Player1'], row['P1 Model'], row['P1 Market']), axis=1)
-    match_df['Player2'] = match_df.apply(lambda row: format_player_name(row['Player2'], row['P2 Model'], row['P2 Market']), axis=1)
-    match_df_html = match_df.to_html(escape=False, index=False)
-    st.markdown(match_df_html, unsafe_allow_html=True)
+    with stage('app.render', tour=selected_tour) as record:
+        match_df = filtered_matches.drop(columns=['Tournament', 'Tour'])
+        match_df['Player1'] = match_df.apply(lambda row: format_player_name(row['Player1'], row['P1 Model'], row['P1 Market']), axis=1)
+        match_df['Player2'] = match_df.apply(lambda row: format_player_name(row['Player2'], row['P2 Model'], row['P2 Market']), axis=1)
+        match_df_html = match_df.to_html(escape=False, index=False)
+        st.markdown(match_df_html, unsafe_allow_html=True)
+        record['rows'] = len(match_df)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Stage timers, row counts and opt-in profiling.
+
+Every timed stage becomes one record: stage name, seconds, rows (when the result has a
+length) and any extra fields such as the tour. Records go to a bounded in-memory log
+that the app's debug panel reads. They are also logged as one JSON line each on the
+'tennis.timings' logger at INFO. Set ONCOURT_TIMING_LOG=1 to send those lines to stderr
+without configuring logging yourself.
+
+SQL statements are timed through SQLAlchemy cursor events (instrument_engine). The gap
+between a query function's record and its 'sql' records is therefore DataFrame work.
+
+ONCOURT_PROFILE=cprofile or pyinstrument turns profile() blocks into profiled runs. The
+.prof or .html output goes to ONCOURT_PROFILE_DIR (default: the working directory).
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+
+logger = logging.getLogger('tennis.timings')
+if os.environ.get('ONCOURT_TIMING_LOG') == '1' and not logger.handlers:
+    logger.addHandler(logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.INFO)
+
+
+class TimingLog:
+    def __init__(self, maxsize=2000):
+        self.entries = deque(maxlen=maxsize)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.entries.append(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def records(self):
+        with self.lock:
+            return list(self.entries)
+
+    def frame(self):
+        records = self.records()
+        extra = sorted({key for record in records for key in record} - {'stage', 'seconds', 'rows'})
+        return pd.DataFrame(records, columns=['stage', 'seconds', 'rows'] + extra)
+
+    def summary(self):
+        """Calls, total and mean milliseconds and rows per stage, slowest stage first."""
+        frame = self.frame()
+        if frame.empty:
+            return pd.DataFrame(columns=['stage', 'calls', 'total_ms', 'mean_ms', 'rows'])
+        summary = frame.groupby('stage').agg(
+            calls=('seconds', 'size'), total_ms=('seconds', 'sum'), mean_ms=('seconds', 'mean'),
+            rows=('rows', 'sum'),
+        )
+        summary[['total_ms', 'mean_ms']] *= 1000
+        return summary.sort_values('total_ms', ascending=False).reset_index()
+
+
+timing_log = TimingLog(maxsize=int(os.environ.get('ONCOURT_TIMING_SIZE', 2000)))
+
+
+def count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray, list)):
+        return len(value)
+    if isinstance(value, (tuple, dict)):
+        # (overall, surface) probability tuples and predict_many style dicts of equally long arrays
+        items = value.values() if isinstance(value, dict) else value
+        lengths = {len(item) for item in items if isinstance(item, np.ndarray)}
+        return lengths.pop() if len(lengths) == 1 else None
+    if hasattr(value, '__len__') and not isinstance(value, str):
+        return len(value)
+    return None
+
+
+@contextmanager
+def stage(name, **fields):
+    """Times the block; set record['rows'] inside it to attach a row count."""
+    record = {'stage': name, 'seconds': 0.0, 'rows': None, **fields}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        timing_log.add(record)
+
+
+def timed(name=None, first_arg=None):
+    """
+    Decorator recording one stage per call, with the row count of the result. first_arg
+    names a field to fill from the first positional argument, e.g. first_arg='tour'.
+    """
+    def decorate(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            fields = {first_arg: args[0]} if first_arg and args else {}
+            with stage(stage_name, **fields) as record:
+                result = func(*args, **kwargs)
+                record['rows'] = count_rows(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def instrument_engine(engine):
+    """Records an 'sql' stage per statement run on engine, with the statement's first line."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('timings', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['timings'].pop()
+        timing_log.add({
+            'stage': 'sql',
+            'seconds': time.perf_counter() - started,
+            'rows': cursor.rowcount if cursor.rowcount >= 0 else None,
+            'statement': statement.strip().split('\n', 1)[0][:120],
+        })
+    return engine
+
+
+@contextmanager
+def profile(name, mode=None):
+    """
+    Profiles the block when mode (default ONCOURT_PROFILE) is 'cprofile' or 'pyinstrument',
+    otherwise does nothing. Returns the output path through the yielded dict.
+    """
+    mode = mode or os.environ.get('ONCOURT_PROFILE', '')
+    output = {'path': None}
+    if mode not in ('cprofile', 'pyinstrument'):
+        yield output
+        return
+
+    directory = os.environ.get('ONCOURT_PROFILE_DIR', '.')
+    stem = os.path.join(directory, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed, falling back to cProfile")
+            mode = 'cprofile'
+
+    if mode == 'pyinstrument':
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield output
+        finally:
+            profiler.stop()
+            output['path'] = stem + '.html'
+            with open(output['path'], 'w') as file:
+                file.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield output
+        finally:
+            profiler.disable()
+            output['path'] = stem + '.prof'
+            profiler.dump_stats(output['path'])
+    logger.info(json.dumps({'stage': 'profile', 'name': name, 'mode': mode, 'path': output['path']}))
@@ -0,0 +1,252 @@
+"""
+Monte Carlo simulation of a live tournament draw.
+
+The bracket is rebuilt from today_*. The lowest main-draw ROUND listed is taken as the
+current round, and its matches sit at their DRAW position. Adjacent matches feed the
+same next-round match. Seeds with a bye are read from later-round rows and play byes
+until their round, and a position nobody covers is an error. Results already in games_*
+for the tournament are fixed. Every pairwise win probability comes from the Elo model in
+one predict_many call.
+
+The simulation then plays every remaining round for all simulations at once. The
+bracket is a (sims x slots) array of player indices, and each round is one gather from
+the probability matrix, one uniform draw and one np.where that halves the slots.
+Nothing loops over individual matches or simulations.
+
+    python tournamentSim.py --tour atp --sims 200000
+    python tournamentSim.py --tour wta --tournament 12345 --check
+"""
+import argparse
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from accessDB import get_draw, get_matches_in_tournament, get_upcoming_matches
+from eloEngine import EloEngine
+from modelStore import load_model
+from timings import timed
+
+# ROUND / ID_R codes below this are pre-qualifying and qualifying rounds
+MAIN_DRAW_FIRST_ROUND = 4
+
+
+@dataclass
+class Bracket:
+    player_ids: np.ndarray  # local index -> OnCourt id
+    names: List[str]
+    slots: np.ndarray       # bracket order of local indices for the current round, -1 for a bye
+    decided: np.ndarray     # (winner, loser) local index pairs already played
+    surface: Optional[str]
+    first_round: int
+
+    @property
+    def rounds(self) -> int:
+        return int(np.log2(len(self.slots)))
+
+
+def build_bracket(draw: pd.DataFrame, played: Optional[pd.DataFrame] = None,
+                  first_round: Optional[int] = None) -> Bracket:
+    """
+    Builds the bracket from a get_draw frame. played is a get_matches_in_tournament frame
+    whose winners (ID1_G) are fixed for any pair in the bracket.
+
+    DRAW is the 1-based match position within its round. A player who first appears in a
+    later round (a seed with a bye) is seated at the top of the part of the current round
+    that feeds their position, against byes. Every current-round position must be covered
+    by a row or by such a seat.
+    """
+    draw = draw.dropna(subset=['ROUND', 'DRAW', 'ID1', 'ID2'])
+    if first_round is None:
+        main_draw = draw[draw['ROUND'] >= MAIN_DRAW_FIRST_ROUND]
+        first_round = int((main_draw if len(main_draw) else draw)['ROUND'].min())
+    draw = draw[draw['ROUND'] >= first_round]
+    if not (draw['ROUND'] == first_round).any():
+        raise ValueError(f"No matches in round {first_round} of the draw")
+    if (draw['DRAW'] < 1).any():
+        raise ValueError("Draw positions start at 1")
+    # depth of each row below the current round, from the round codes present
+    depth = draw['ROUND'].rank(method='dense').to_numpy(dtype=np.int64) - 1
+    draw = draw.assign(depth=depth).sort_values(['depth', 'DRAW'], kind='stable')
+
+    seats = {}  # OnCourt id -> (slot, first current-round match covered, depth of first row)
+    names = {}
+    for row in draw.itertuples(index=False):
+        for side, (player, name) in enumerate(((row.ID1, row.Player1), (row.ID2, row.Player2))):
+            player = int(player)
+            if player in seats:
+                continue
+            if row.depth == 0:
+                seats[player] = (2 * (int(row.DRAW) - 1) + side, int(row.DRAW) - 1, 0)
+            else:
+                start = (2 * (int(row.DRAW) - 1) + side) << (row.depth - 1)
+                seats[player] = (2 * start, start, row.depth)
+            names[player] = str(name)
+
+    def covers(depth):
+        return 1 << max(depth - 1, 0)
+
+    n_matches = 1 << (max(start + covers(depth) for _, start, depth in seats.values()) - 1).bit_length()
+    player_ids = np.array(sorted(seats), dtype=np.int64)
+    slots = np.full(2 * n_matches, -1, dtype=np.int32)
+    owner = np.full(n_matches, -1, dtype=np.int64)  # the match or seat covering each position
+    for local, player in enumerate(player_ids.tolist()):
+        slot, start, depth = seats[player]
+        covered = owner[start:start + covers(depth)]
+        shared = start if depth == 0 else -1  # both players of a current-round match cover it
+        if slots[slot] >= 0 or ((covered >= 0) & (covered != shared)).any():
+            raise ValueError(f"Draw position {start + 1} is claimed twice")
+        slots[slot] = local
+        covered[:] = start if depth == 0 else n_matches + start
+    if (owner < 0).any():
+        raise ValueError(f"Draw position {int(np.flatnonzero(owner < 0)[0]) + 1} has no players")
+    if ((owner < n_matches) & ((slots[0::2] < 0) | (slots[1::2] < 0))).any():
+        raise ValueError("A current-round match is missing a player")
+
+    decided = np.empty((0, 2), dtype=np.int64)
+    if played is not None and len(played):
+        played = played[played['ID_R_G'].astype('Int64').fillna(-1).to_numpy() >= first_round]
+        lookup = pd.Index(player_ids)
+        winners = lookup.get_indexer(played['ID1_G'].astype('Int64').fillna(-1).to_numpy(dtype=np.int64))
+        losers = lookup.get_indexer(played['ID2_G'].astype('Int64').fillna(-1).to_numpy(dtype=np.int64))
+        both = (winners >= 0) & (losers >= 0)
+        decided = np.column_stack([winners[both], losers[both]])
+
+    surfaces = draw['Surface'].dropna()
+    return Bracket(
+        player_ids=player_ids,
+        names=[names[player] for player in player_ids.tolist()],
+        slots=slots,
+        decided=decided,
+        surface=str(surfaces.iloc[0]) if len(surfaces) else None,
+        first_round=first_round,
+    )
+
+
+def win_matrix(bracket: Bracket, model: EloEngine, column: str = 'surface') -> np.ndarray:
+    """
+    (players + 1) square matrix of P(row beats column). The extra last index is the bye:
+    everyone beats it, and a bye against a bye stays a bye. Played matches are set to 0/1.
+    """
+    k = len(bracket.player_ids)
+    rows, columns = np.divmod(np.arange(k * k), k)
+    surfaces = None if bracket.surface is None else np.full(k * k, bracket.surface, dtype=object)
+    probs = model.predict_many(bracket.player_ids[rows], bracket.player_ids[columns], surfaces)[column]
+
+    matrix = np.ones((k + 1, k + 1), dtype=np.float32)
+    matrix[:k, :k] = probs.reshape(k, k)
+    matrix[k, :k] = 0
+    winners, losers = bracket.decided[:, 0], bracket.decided[:, 1]
+    matrix[winners, losers] = 1
+    matrix[losers, winners] = 0
+    return matrix
+
+
+def simulate(slots: np.ndarray, matrix: np.ndarray, sims: int = 100_000, seed: Optional[int] = None,
+             batch_size: int = 100_000) -> np.ndarray:
+    """
+    Plays the bracket sims times. Returns (rounds + 1, players): the share of simulations in
+    which each player reached round r, where r = 0 is the current round and the last row
+    is the title.
+    """
+    rng = np.random.default_rng(seed)
+    bye = len(matrix) - 1
+    slots = np.where(slots < 0, bye, slots).astype(np.int64)
+    rounds = int(np.log2(len(slots)))
+    flat, width = matrix.ravel(), len(matrix)
+
+    counts = np.zeros((rounds + 1, width), dtype=np.int64)
+    for start in range(0, sims, batch_size):
+        n = min(batch_size, sims - start)
+        counts[0] += np.bincount(slots, minlength=width) * n
+        alive = np.broadcast_to(slots, (n, len(slots)))
+        for r in range(1, rounds + 1):
+            first, second = alive[:, 0::2], alive[:, 1::2]
+            wins = rng.random(first.shape, dtype=np.float32) < flat.take(first * width + second)
+            alive = np.where(wins, first, second)
+            counts[r] += np.bincount(alive.ravel(), minlength=width)
+    return counts[:, :bye] / sims
+
+
+def exact_reach(slots: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """
+    The exact counterpart of simulate, for checking it. Each round pairs neighbouring blocks
+    of slots; a slot's chance of winning its new block is its chance of winning its old one
+    times its chance of beating whoever comes out of the other. O(slots^2) per round.
+    """
+    bye = len(matrix) - 1
+    slots = np.where(slots < 0, bye, slots).astype(np.int64)
+    rounds = int(np.log2(len(slots)))
+    alive = np.ones(len(slots))
+    reach = np.zeros((rounds + 1, len(matrix)))
+    reach[0] = np.bincount(slots, minlength=len(matrix))
+    for r in range(1, rounds + 1):
+        block = 1 << (r - 1)
+        players, chances = slots.reshape(-1, 2, block), alive.reshape(-1, 2, block)
+        beats = matrix[players[:, 0, :, None], players[:, 1, None, :]]
+        first = chances[:, 0] * np.einsum('mij,mj->mi', beats, chances[:, 1])
+        second = chances[:, 1] * np.einsum('mij,mi->mj', 1 - beats, chances[:, 0])
+        alive = np.stack([first, second], axis=1).ravel()
+        reach[r] = np.bincount(slots, weights=alive, minlength=len(matrix))
+    return reach[:, :bye]
+
+
+def round_label(remaining: int) -> str:
+    """Name of the round played by `remaining` players."""
+    return {1: 'title', 2: 'F', 4: 'SF', 8: 'QF'}.get(remaining, f'R{remaining}')
+
+
+@timed()
+def bracket_odds(bracket: Bracket, model: EloEngine, sims: int = 100_000, seed: Optional[int] = None,
+                 column: str = 'surface') -> pd.DataFrame:
+    """Per-player probability of reaching every later round and of winning the title."""
+    reach = simulate(bracket.slots, win_matrix(bracket, model, column), sims, seed)
+    frame = pd.DataFrame({'ID': bracket.player_ids, 'Player': bracket.names})
+    for r in range(1, bracket.rounds + 1):
+        label = round_label(len(bracket.slots) >> r)
+        frame[label if label == 'title' else f'reach_{label}'] = reach[r]
+    return frame.sort_values('title', ascending=False, ignore_index=True)
+
+
+@timed(first_arg='tour')
+def simulate_tournament(tour: str, tournament_id: int, model: EloEngine, sims: int = 100_000,
+                        seed: Optional[int] = None, column: str = 'surface') -> pd.DataFrame:
+    draw = get_draw(tour, tournament_id)
+    if draw is None or draw.empty:
+        raise ValueError(f"No {tour} draw found for tournament {tournament_id}")
+    played = get_matches_in_tournament(tour, [int(tournament_id)])
+    return bracket_odds(build_bracket(draw, played), model, sims, seed, column)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the remaining draw of live tournaments")
+    parser.add_argument('--tour', choices=['atp', 'wta'], default='wta')
+    parser.add_argument('--tournament', type=int, action='append', help="defaults to every tournament on today's card")
+    parser.add_argument('--sims', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--model', default=None, help="defaults to elo_model_<tour>")
+    parser.add_argument('--top', type=int, default=16)
+    parser.add_argument('--check', action='store_true', help="compare the simulation with the exact odds")
+    args = parser.parse_args()
+
+    model = load_model(args.model or f'elo_model_{args.tour}')
+    tournament_ids = args.tournament
+    if not tournament_ids:
+        upcoming = get_upcoming_matches(args.tour)
+        tournament_ids = [] if upcoming is None else pd.to_numeric(upcoming['TOUR'], errors='coerce').dropna().astype(int).unique().tolist()
+
+    for tournament_id in tournament_ids:
+        try:
+            odds = simulate_tournament(args.tour, tournament_id, model, args.sims, args.seed)
+        except ValueError as e:
+            print(f"Skipping {tournament_id}: {e}")
+            continue
+        print(f"Tournament {tournament_id}")
+        if args.check:
+            bracket = build_bracket(get_draw(args.tour, tournament_id),
+                                    get_matches_in_tournament(args.tour, [int(tournament_id)]))
+            matrix = win_matrix(bracket, model)
+            error = np.abs(simulate(bracket.slots, matrix, args.sims, args.seed) - exact_reach(bracket.slots, matrix)).max()
+            print(f"Largest gap between simulated and exact odds: {error:.4f}")
+        print(odds.head(args.top).to_string(index=False, float_format=lambda value: f"{value:.3f}"))